@@ -1,3 +1,10 @@
-__all__ = ['AsyncDocument']
+__all__ = [
+    'AsyncDocument',
+    'async_run_in_transaction',
+    'async_transaction',
+    'configure_executor',
+]
 
 from .async_document import AsyncDocument
+from .executor import configure_executor
+from .transaction import async_run_in_transaction, async_transaction
@@ -1,8 +1,29 @@
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List, Optional
+
 from mongoengine import Document
 
+from ..types.encrypted_string.query_set import async_encrypt_document
 from .async_query_set import AsyncQuerySet
-from .async_signals import post_save, pre_save
-from .utils import create_awaitable
+from .async_signals import post_delete, post_save, pre_delete, pre_save
+from .change_stream import (
+    WATCH_MAX_AWAIT_TIME_MS,
+    ChangeEvent,
+    ResumeTokenStore,
+    watch,
+)
+from .transaction import bind_session
+from .utils import (
+    create_awaitable,
+    create_write_awaitable,
+    to_max_time_ms,
+    with_timeout,
+)
+
+# `maxTimeMS` of the queries of the document's `_qs`, set by `async_reload`
+_max_time_ms: ContextVar[Optional[int]] = ContextVar(
+    'max_time_ms', default=None
+)
 
 
 class AsyncDocument(Document):
@@ -11,21 +32,94 @@ class AsyncDocument(Document):
         queryset_class=AsyncQuerySet,
     )
 
+    @classmethod
+    def _get_collection(cls):
+        return bind_session(super()._get_collection())
+
+    @property
+    def _qs(self):
+        queryset = super()._qs
+        max_time_ms = _max_time_ms.get()
+        if max_time_ms is not None:
+            queryset = queryset.max_time_ms(max_time_ms)
+        return queryset
+
     async def async_save(self, *args, **kwargs):
         signal_kwargs = kwargs.pop("signal_kwargs", {})
+        timeout = kwargs.pop("timeout", None)
         await pre_save.send_async(
             self.__class__, document=self, **signal_kwargs
         )
-        result = await create_awaitable(self.save, *args, **kwargs)
+        # on the crypto executor, not in the write
+        await async_encrypt_document(self)
+        result = await with_timeout(
+            create_write_awaitable(self.save, *args, **kwargs), timeout
+        )
         await post_save.send_async(
             self.__class__, document=self, **signal_kwargs
         )
         return result
 
-    async def async_reload(self, *fields, **kwargs):
-        return await create_awaitable(self.reload, *fields, **kwargs)
+    async def async_reload(
+        self, *fields, timeout: Optional[float] = None, **kwargs
+    ):
+        # the executor runs `reload` with a copy of the context
+        token = _max_time_ms.set(to_max_time_ms(timeout))
+        try:
+            return await with_timeout(
+                create_awaitable(self.reload, *fields, **kwargs), timeout
+            )
+        finally:
+            _max_time_ms.reset(token)
+
+    async def async_delete(
+        self,
+        signal_kwargs=None,
+        timeout: Optional[float] = None,
+        **write_concern,
+    ):
+        signal_kwargs = signal_kwargs or {}
+        await pre_delete.send_async(
+            self.__class__, document=self, **signal_kwargs
+        )
+        result = await with_timeout(
+            create_write_awaitable(
+                self.delete, signal_kwargs, **write_concern
+            ),
+            timeout,
+        )
+        await post_delete.send_async(
+            self.__class__, document=self, **signal_kwargs
+        )
+        return result
 
-    async def async_delete(self, signal_kwargs=None, **write_concern):
-        return await create_awaitable(
-            self.delete, signal_kwargs, **write_concern
+    @classmethod
+    def async_watch(
+        cls,
+        pipeline: Optional[List[Dict]] = None,
+        full_document: Optional[str] = None,
+        resume_after: Optional[Dict] = None,
+        start_after: Optional[Dict] = None,
+        max_await_time_ms: int = WATCH_MAX_AWAIT_TIME_MS,
+        batch_size: Optional[int] = None,
+        token_store: Optional[ResumeTokenStore] = None,
+        name: Optional[str] = None,
+    ) -> AsyncIterator[ChangeEvent]:
+        """
+        Watches the collection for changes and yields them with the
+        documents already built. Changes are fetched in batches, waiting
+        up to `max_await_time_ms` for each one. With a `token_store` the
+        resume token is saved after each batch and the stream `name`
+        resumes from it the next time it's watched
+        """
+        return watch(
+            cls,
+            pipeline=pipeline,
+            full_document=full_document,
+            resume_after=resume_after,
+            start_after=start_after,
+            max_await_time_ms=max_await_time_ms,
+            batch_size=batch_size,
+            token_store=token_store,
+            name=name,
         )
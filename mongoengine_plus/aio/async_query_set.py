@@ -1,23 +1,362 @@
-from mongoengine import QuerySet
+from functools import partial
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
 
-from .utils import create_awaitable
+from mongoengine import ListField
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
 
+from ..models.encoder import JSON_CHUNK_SIZE, async_iter_json_array
+from ..models.query_set import BaseQuerySet, document_serializer
+from ..types.encrypted_string.query_set import async_decrypt_documents
+from .async_signals import post_bulk_insert
+from .backend import get_motor_collection, motor_enabled
+from .loader import DataLoader
+from .transaction import bind_session, current_session
+from .utils import (
+    ExecutorCursor,
+    create_awaitable,
+    create_write_awaitable,
+    to_max_time_ms,
+    with_timeout,
+)
 
-class AsyncQuerySet(QuerySet):
-    async def async_first(self):
-        return await create_awaitable(self.first)
+# documents per `to_list` call when iterating a Motor cursor
+MOTOR_BATCH_SIZE = 101
 
-    async def async_get(self, *q_objs, **query):
-        return await create_awaitable(self.get, *q_objs, **query)
 
-    async def async_count(self, with_limit_and_skip=False):
-        return await create_awaitable(self.count, with_limit_and_skip)
+class AsyncQuerySet(BaseQuerySet):
+    """
+    QuerySet with async versions of its methods. They run in a thread by
+    default, the queries run natively on Motor after `use_motor()`.
 
-    async def async_to_list(self):
-        return await create_awaitable(list, self)
+    Their `timeout`, in seconds, is sent to the server as `maxTimeMS` when
+    the command supports it and the call is cancelled after it. Cursors
+    of cancelled calls are closed
+    """
 
-    async def async_update(self, *u_objs, **query):
-        return await create_awaitable(self.update, *u_objs, **query)
+    @property
+    def _collection(self):
+        return bind_session(self._collection_obj)
+
+    @property
+    def _cursor(self):
+        # mongoengine only sets max_time_ms on the cursor it had when called
+        created = self._cursor_obj is None
+        cursor = super()._cursor
+        if created and self._max_time_ms is not None:
+            cursor.max_time_ms(self._max_time_ms)
+        return cursor
+
+    async def __aiter__(self) -> AsyncIterator:
+        """
+        Iterates over the results one cursor batch at a time, set its size
+        with `batch_size` and the time limit of each batch with
+        `max_time_ms`. Only the current batch is kept in memory
+        """
+        if self._none or self._empty:
+            return
+
+        async for raw_docs in self._async_raw_batches():
+            if self._as_pymongo:
+                for raw_doc in raw_docs:
+                    yield raw_doc
+                continue
+            await async_decrypt_documents(self._document, raw_docs)
+            for raw_doc in raw_docs:
+                yield self._from_raw(raw_doc)
+
+    async def async_first(self, timeout: Optional[float] = None):
+        queryset = self._timed(timeout)
+        if not motor_enabled():
+            return await with_timeout(
+                create_awaitable(queryset.first), timeout
+            )
+        if self._none or self._empty:
+            return None
+
+        result = await queryset.limit(1).async_to_list(timeout)
+        return result[0] if result else None
+
+    async def async_get(
+        self, *q_objs, timeout: Optional[float] = None, **query
+    ):
+        queryset = self._timed(timeout)
+        if not motor_enabled():
+            return await with_timeout(
+                create_awaitable(queryset.get, *q_objs, **query), timeout
+            )
+
+        queryset = queryset.order_by().limit(2)
+        queryset = queryset.filter(*q_objs, **query)
+        result = await queryset.async_to_list(timeout)
+        if not result:
+            msg = (
+                f'{queryset._document._class_name} matching query '
+                'does not exist.'
+            )
+            raise queryset._document.DoesNotExist(msg)
+        if len(result) > 1:
+            raise queryset._document.MultipleObjectsReturned(
+                '2 or more items returned, instead of 1'
+            )
+        return result[0]
+
+    async def async_in_bulk(
+        self, object_ids: Iterable, timeout: Optional[float] = None
+    ) -> Dict[Any, Any]:
+        """
+        Returns the documents with the ids in `object_ids`, by id, fetched
+        with a single `$in` query
+        """
+        queryset = self.clone().filter(pk__in=list(object_ids))
+        documents = await queryset.async_to_list(timeout)
+        if self._as_pymongo:
+            return {document['_id']: document for document in documents}
+        return {document.pk: document for document in documents}
+
+    def loader(self, max_batch_size: Optional[int] = None) -> DataLoader:
+        return DataLoader(self, max_batch_size)
+
+    async def async_count(
+        self, with_limit_and_skip=False, timeout: Optional[float] = None
+    ):
+        with_motor = motor_enabled()
+        in_transaction = current_session() is not None
+        if not with_motor and not in_transaction and timeout is None:
+            return await create_awaitable(self.count, with_limit_and_skip)
+        if (
+            self._limit == 0
+            and with_limit_and_skip is False
+            or self._none
+            or self._empty
+        ):
+            return 0
+
+        kwargs: Dict[str, Any] = {}
+        if with_limit_and_skip:
+            if self._limit:
+                kwargs['limit'] = self._limit
+            if self._skip is not None:
+                kwargs['skip'] = self._skip
+        if self._hint not in (-1, None):
+            kwargs['hint'] = self._hint
+        if self._collation:
+            kwargs['collation'] = self._collation
+        if timeout is not None:
+            kwargs['maxTimeMS'] = to_max_time_ms(timeout)
+
+        # `count` neither uses the session nor sends maxTimeMS
+        collection = (
+            self._motor_collection() if with_motor else self._collection
+        )
+        # estimated counts can't run in transactions
+        if self._query or set(kwargs) - {'maxTimeMS'} or in_transaction:
+            count = partial(collection.count_documents, self._query)
+        else:
+            count = collection.estimated_document_count
+        if with_motor:
+            return await with_timeout(count(**kwargs), timeout)
+        return await with_timeout(create_awaitable(count, **kwargs), timeout)
+
+    async def async_to_list(self, timeout: Optional[float] = None):
+        queryset = self._timed(timeout)
+        return await with_timeout(queryset._async_list(), timeout)
+
+    async def async_to_dicts(
+        self,
+        only: Optional[Iterable[str]] = None,
+        exclude: Iterable[str] = (),
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[Dict]:
+        if self._none or self._empty:
+            return
+
+        queryset, spec = self._timed(timeout)._projected(only, exclude)
+        serializer = document_serializer(self._document, *spec)
+        async for raw_docs in queryset._async_raw_batches():
+            await async_decrypt_documents(
+                self._document, raw_docs, serializer.encrypted_fields
+            )
+            for raw_doc in raw_docs:
+                yield self._son_serializer(
+                    raw_doc, serializer, *spec
+                ).from_son(raw_doc)
+
+    def async_iter_json(
+        self,
+        only: Optional[Iterable[str]] = None,
+        exclude: Iterable[str] = (),
+        chunk_size: int = JSON_CHUNK_SIZE,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[bytes]:
+        return async_iter_json_array(
+            self.async_to_dicts(only, exclude, timeout), chunk_size
+        )
+
+    async def async_aggregate(
+        self, pipeline: List[Dict], timeout: Optional[float] = None, **kwargs
+    ) -> AsyncIterator[Dict]:
+        """
+        Runs the aggregation `pipeline` on the documents of the queryset
+        and yields its results as they're fetched, one batch at a time.
+        `kwargs` are passed to pymongo's `aggregate`, e.g.
+        `allowDiskUse=True` or `batchSize=1000`
+        """
+        if timeout is not None:
+            kwargs.setdefault('maxTimeMS', to_max_time_ms(timeout))
+        queryset = self.clone()
+        if motor_enabled():
+            queryset._collection_obj = self._motor_collection()
+            cursor = queryset.aggregate(pipeline, **kwargs)
+        else:
+            cursor = await with_timeout(
+                create_awaitable(queryset.aggregate, pipeline, **kwargs),
+                timeout,
+            )
+        async for results in self._async_batches(
+            cursor, kwargs.get('batchSize'), timeout
+        ):
+            for result in results:
+                yield result
+
+    async def async_distinct(self, field, timeout: Optional[float] = None):
+        queryset = self._timed(timeout)
+        return await with_timeout(
+            create_awaitable(queryset.distinct, field), timeout
+        )
+
+    async def async_sum(self, field, timeout: Optional[float] = None):
+        return await self._async_total('$sum', field, timeout)
+
+    async def async_average(self, field, timeout: Optional[float] = None):
+        return await self._async_total('$avg', field, timeout)
+
+    async def async_item_frequencies(
+        self, field, normalize=False, timeout: Optional[float] = None
+    ):
+        """
+        Like `item_frequencies`, counted with an aggregation instead of
+        map-reduce, so the `timeout` is sent as `maxTimeMS`
+        """
+        db_field = self._fields_to_dbfields([field]).pop()
+        pipeline = [
+            # missing fields count as None and each item of lists apart
+            {'$project': {'item': {'$ifNull': ['$' + db_field, [None]]}}},
+            {'$unwind': '$item'},
+            {'$group': {'_id': '$item', 'count': {'$sum': 1}}},
+        ]
+        frequencies = {}
+        async for result in self.order_by().async_aggregate(
+            pipeline, timeout=timeout
+        ):
+            key = result['_id']
+            if isinstance(key, float) and key.is_integer():
+                key = int(key)
+            frequencies[key] = result['count']
+        if normalize:
+            total = sum(frequencies.values())
+            frequencies = {
+                key: count / total for key, count in frequencies.items()
+            }
+        return frequencies
+
+    async def async_explain(self, timeout: Optional[float] = None):
+        queryset = self._timed(timeout)
+        return await with_timeout(create_awaitable(queryset.explain), timeout)
+
+    async def _async_total(
+        self, operator: str, field: str, timeout: Optional[float]
+    ) -> Any:
+        # the pipeline of mongoengine's `sum` and `average`, aggregated with
+        # `maxTimeMS`
+        db_field = self._fields_to_dbfields([field]).pop()
+        pipeline: List[Dict] = [
+            {'$group': {'_id': None, 'total': {operator: '$' + db_field}}}
+        ]
+        # the items of lists are aggregated one by one
+        if isinstance(
+            self._document._lookup_field(field.split('.'))[-1], ListField
+        ):
+            pipeline.insert(0, {'$unwind': '$' + db_field})
+        results = [
+            result
+            async for result in self.order_by().async_aggregate(
+                pipeline, timeout=timeout
+            )
+        ]
+        return results[0]['total'] if results else 0
+
+    def _timed(self, timeout: Optional[float]) -> 'AsyncQuerySet':
+        # a clone whose queries the server stops after `timeout` seconds
+        queryset = self.clone()
+        if timeout is not None:
+            queryset._max_time_ms = to_max_time_ms(timeout)
+        return queryset
+
+    async def _async_list(self) -> List:
+        return [document async for document in self]
+
+    async def _async_raw_batches(self) -> AsyncIterator[List[Dict]]:
+        queryset = self.clone()
+        if motor_enabled():
+            cursor = queryset._motor_cursor()
+        else:
+            cursor = queryset._cursor
+        timeout = self._max_time_ms / 1000 if self._max_time_ms else None
+        async for raw_docs in self._async_batches(
+            cursor, self._batch_size, timeout
+        ):
+            yield raw_docs
+
+    async def _async_batches(
+        self,
+        cursor,
+        batch_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[List[Dict]]:
+        # one batch of a pymongo or Motor cursor per await, each one within
+        # `timeout`. The cursor is closed if the iteration stops early, e.g.
+        # when the task is cancelled
+        if motor_enabled():
+            length = batch_size or MOTOR_BATCH_SIZE
+            try:
+                while raw_docs := await with_timeout(
+                    cursor.to_list(length=length), timeout
+                ):
+                    yield raw_docs
+            finally:
+                await cursor.close()
+        else:
+            executor_cursor = ExecutorCursor(cursor)
+            try:
+                while raw_docs := await with_timeout(
+                    executor_cursor.next_batch(), timeout
+                ):
+                    yield raw_docs
+            finally:
+                executor_cursor.close()
+
+    def _motor_collection(self):
+        return get_motor_collection(
+            self._collection,
+            self._document._meta.get('db_alias', DEFAULT_CONNECTION_NAME),
+        )
+
+    def _motor_cursor(self):
+        # the same cursor mongoengine builds, on the Motor collection
+        queryset = self.clone()
+        queryset._collection_obj = self._motor_collection()
+        queryset._cursor_obj = None
+        return queryset._cursor
+
+    # writes can't be stopped once they're sent, `timeout` only stops
+    # waiting for them
+
+    async def async_update(
+        self, *u_objs, timeout: Optional[float] = None, **query
+    ):
+        return await with_timeout(
+            create_write_awaitable(self.update, *u_objs, **query), timeout
+        )
 
     async def async_insert(
         self,
@@ -25,16 +364,46 @@ class AsyncQuerySet(QuerySet):
         load_bulk=True,
         write_concern=None,
         signal_kwargs=None,
+        timeout: Optional[float] = None,
     ):
-        return await create_awaitable(
-            self.insert, doc_or_docs, load_bulk, write_concern, signal_kwargs
+        result = await with_timeout(
+            create_write_awaitable(
+                self.insert,
+                doc_or_docs,
+                load_bulk,
+                write_concern,
+                signal_kwargs,
+            ),
+            timeout,
+        )
+        await post_bulk_insert.send_async(
+            self._document,
+            documents=result if isinstance(result, list) else [result],
+            loaded=load_bulk,
+            **(signal_kwargs or {}),
+        )
+        return result
+
+    async def async_bulk_write(
+        self, operations, ordered=True, timeout: Optional[float] = None
+    ):
+        return await with_timeout(
+            create_write_awaitable(self.bulk_write, operations, ordered),
+            timeout,
         )
 
     async def async_delete(
-        self, write_concern=None, _from_doc_delete=False, cascade_refs=None
+        self,
+        write_concern=None,
+        _from_doc_delete=False,
+        cascade_refs=None,
+        timeout: Optional[float] = None,
     ):
-        return await create_awaitable(
-            self.delete, write_concern, _from_doc_delete, cascade_refs
+        return await with_timeout(
+            create_write_awaitable(
+                self.delete, write_concern, _from_doc_delete, cascade_refs
+            ),
+            timeout,
         )
 
     async def async_modify(
@@ -44,14 +413,18 @@ class AsyncQuerySet(QuerySet):
         remove=False,
         new=False,
         array_filters=None,
+        timeout: Optional[float] = None,
         **update,
     ):
-        return await create_awaitable(
-            self.modify,
-            upsert=upsert,
-            full_response=full_response,
-            remove=remove,
-            new=new,
-            array_filters=array_filters,
-            **update,
+        return await with_timeout(
+            create_write_awaitable(
+                self.modify,
+                upsert=upsert,
+                full_response=full_response,
+                remove=remove,
+                new=new,
+                array_filters=array_filters,
+                **update,
+            ),
+            timeout,
         )
@@ -1,6 +1,168 @@
+import asyncio
+import logging
+import weakref
+from inspect import iscoroutinefunction
+from typing import Any, Callable, List, NamedTuple, Optional, Set, Tuple
+
+from blinker import NamedSignal
 from mongoengine.signals import Namespace
 
+logger = logging.getLogger(__name__)
+
+MAX_BACKGROUND_RECEIVERS = 100
+
+
+class ReceiverOptions(NamedTuple):
+    concurrent: bool = False
+    background: bool = False
+    timeout: Optional[float] = None
+
+
+def receiver_options(
+    concurrent: bool = False,
+    background: bool = False,
+    timeout: Optional[float] = None,
+):
+    """
+    Sets how an async signal runs the decorated receiver:
+    `concurrent` receivers don't depend on the others and run at the same
+    time, `background` ones run in a task the sender doesn't wait for, and
+    `timeout` is the time in seconds the receiver has to finish
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        fn.signal_options = ReceiverOptions(  # type: ignore[attr-defined]
+            concurrent, background, timeout
+        )
+        return fn
+
+    return decorator
+
+
+def log_receiver_error(
+    signal: 'AsyncSignal', receiver: Callable, error: BaseException
+) -> None:
+    logger.error(
+        'Receiver %r of %s failed',
+        receiver,
+        signal.name,
+        exc_info=(type(error), error, error.__traceback__),
+    )
+
+
+class AsyncSignal(NamedSignal):
+    """
+    Signal whose async receivers run in order by default, like blinker's
+    `send_async`. Receivers can run concurrently, in background tasks and
+    with a timeout, see `receiver_options`. At most `max_background` background
+    receivers run at once and their errors are reported to `on_error`
+    """
+
+    def __init__(
+        self,
+        name: str,
+        doc: Optional[str] = None,
+        max_background: int = MAX_BACKGROUND_RECEIVERS,
+        on_error: Callable = log_receiver_error,
+    ) -> None:
+        super().__init__(name, doc)
+        self.max_background = max_background
+        self.on_error = on_error
+        self._background: Set[asyncio.Task] = set()
+        # asyncio semaphores belong to a single event loop
+        self._slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    async def send_async(  # type: ignore[override]
+        self, sender: Any = None, /, *, _sync_wrapper=None, **kwargs
+    ) -> List[Tuple[Callable, Any]]:
+        if self.is_muted:
+            return []
+
+        results: List[Tuple[Callable, Any]] = []
+        concurrent: List[Tuple[Callable, asyncio.Future]] = []
+        try:
+            for receiver in self.receivers_for(sender):
+                options = getattr(
+                    receiver, 'signal_options', ReceiverOptions()
+                )
+                call = receiver
+                if not iscoroutinefunction(receiver):
+                    if _sync_wrapper is None:
+                        raise RuntimeError(
+                            'Cannot send to a non-coroutine function.'
+                        )
+                    call = _sync_wrapper(receiver)
+                coro = self._call(call, options.timeout, sender, kwargs)
+
+                if options.background:
+                    results.append((receiver, self._spawn(receiver, coro)))
+                elif options.concurrent:
+                    concurrent.append((receiver, asyncio.ensure_future(coro)))
+                else:
+                    results.append((receiver, await coro))
+
+            if concurrent:
+                values = await asyncio.gather(
+                    *[task for _, task in concurrent]
+                )
+                results.extend(
+                    (receiver, value)
+                    for (receiver, _), value in zip(concurrent, values)
+                )
+        except BaseException:
+            for _, task in concurrent:
+                task.cancel()
+            raise
+        return results
+
+    async def join(self) -> None:
+        """
+        Waits for the background receivers that are running
+        """
+        while self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    async def _call(
+        self,
+        receiver: Callable,
+        timeout: Optional[float],
+        sender: Any,
+        kwargs: dict,
+    ) -> Any:
+        if timeout is None:
+            return await receiver(sender, **kwargs)
+        return await asyncio.wait_for(receiver(sender, **kwargs), timeout)
+
+    def _spawn(self, receiver: Callable, coro: Any) -> asyncio.Task:
+        task = asyncio.ensure_future(self._run_in_background(receiver, coro))
+        # the loop only keeps weak references to its tasks
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def _run_in_background(self, receiver: Callable, coro: Any) -> None:
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots[loop] = asyncio.Semaphore(self.max_background)
+        async with slots:
+            try:
+                await coro
+            except Exception as error:
+                self.on_error(self, receiver, error)
+
+
 async_signals = Namespace()
 
-pre_save = async_signals.signal("pre_save")
-post_save = async_signals.signal("post_save")
+
+def signal(name: str, doc: Optional[str] = None) -> AsyncSignal:
+    if name not in async_signals:
+        async_signals[name] = AsyncSignal(name, doc)
+    return async_signals[name]
+
+
+pre_save = signal("pre_save")
+post_save = signal("post_save")
+pre_delete = signal("pre_delete")
+post_delete = signal("post_delete")
+post_bulk_insert = signal("post_bulk_insert")
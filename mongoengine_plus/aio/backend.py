@@ -0,0 +1,100 @@
+import asyncio
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+from mongoengine.connection import _connection_settings
+
+from .transaction import current_session
+
+# motor 2.x, the one that works with pymongo 3, uses `asyncio.coroutine`,
+# removed in Python 3.11
+MOTOR_SUPPORTED = sys.version_info < (3, 11)
+
+_motor_import_error: Optional[ImportError] = None
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError as error:  # pragma: no cover
+    AsyncIOMotorClient = None
+    _motor_import_error = error
+
+# settings of mongoengine's connections that MongoClient doesn't accept
+IGNORED_SETTINGS = {'name', 'mongo_client_class'}
+# mongoengine's names of the settings MongoClient accepts with other names
+RENAMED_SETTINGS = {
+    'authentication_source': 'authSource',
+    'authentication_mechanism': 'authMechanism',
+}
+
+_motor_enabled = False
+_motor_clients: Dict[str, Tuple[asyncio.AbstractEventLoop, Any]] = {}
+
+
+def use_motor(enabled: bool = True) -> None:
+    """
+    Runs the queries of `AsyncQuerySet` with Motor instead of running the
+    pymongo calls in a thread. Motor is an optional dependency:
+    `pip install mongoengine-plus[motor]`, only available before Python 3.11
+    """
+    global _motor_enabled
+    if enabled and AsyncIOMotorClient is None:
+        if not MOTOR_SUPPORTED:
+            raise ImportError(
+                'the motor backend needs Python < 3.11, motor 2.x '
+                "can't be imported on Python 3.11+"
+            ) from _motor_import_error
+        raise ImportError(
+            'motor is required to use the motor backend'
+        ) from _motor_import_error
+    _motor_enabled = enabled
+    close_motor_clients()
+
+
+def motor_enabled() -> bool:
+    # sessions belong to a client, so transactions run with pymongo
+    return _motor_enabled and current_session() is None
+
+
+def get_motor_client(alias: str) -> Any:
+    """
+    Returns a Motor client with the same settings of the mongoengine
+    connection `alias`. Motor clients are bound to an event loop, so a new
+    one is created, and the previous one closed, if the running loop
+    changes
+    """
+    loop = asyncio.get_running_loop()
+    cached = _motor_clients.get(alias)
+    if cached and cached[0] is loop:
+        return cached[1]
+    if cached:
+        cached[1].close()
+
+    settings = {
+        RENAMED_SETTINGS.get(key, key): value
+        for key, value in _connection_settings[alias].items()
+        if key not in IGNORED_SETTINGS and value is not None
+    }
+    client = AsyncIOMotorClient(io_loop=loop, **settings)
+    _motor_clients[alias] = (loop, client)
+    return client
+
+
+def get_motor_collection(collection: Any, alias: str) -> Any:
+    """
+    Returns the Motor version of the pymongo `collection`, with the same
+    database, name and options
+    """
+    database = get_motor_client(alias)[collection.database.name]
+    return database.get_collection(
+        collection.name,
+        codec_options=collection.codec_options,
+        read_preference=collection.read_preference,
+        write_concern=collection.write_concern,
+        read_concern=collection.read_concern,
+    )
+
+
+def close_motor_clients(alias: Optional[str] = None) -> None:
+    for key in [alias] if alias else list(_motor_clients):
+        cached = _motor_clients.pop(key, None)
+        if cached:
+            cached[1].close()
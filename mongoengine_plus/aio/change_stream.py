@@ -0,0 +1,162 @@
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
+
+from mongoengine import get_db
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+
+from ..cursor import buffered
+from ..types.encrypted_string.query_set import async_decrypt_documents
+from .backend import get_motor_collection, motor_enabled
+from .utils import create_awaitable, create_write_awaitable
+
+WATCH_MAX_AWAIT_TIME_MS = 1000
+
+
+class ChangeEvent(NamedTuple):
+    operation_type: str
+    document_key: Optional[Dict]
+    document: Any
+    update_description: Optional[Dict]
+    raw: Dict
+
+
+class ResumeTokenStore:
+    """
+    Keeps the resume token of each change stream, so `async_watch` can
+    continue where it stopped. This one keeps them in memory, subclass it
+    to keep them somewhere else
+    """
+
+    def __init__(self) -> None:
+        self.tokens: Dict[str, Dict] = {}
+
+    async def load(self, name: str) -> Optional[Dict]:
+        return self.tokens.get(name)
+
+    async def save(self, name: str, token: Dict) -> None:
+        self.tokens[name] = token
+
+
+class CollectionResumeTokenStore(ResumeTokenStore):
+    """
+    Keeps the resume tokens in a MongoDB collection, one document per
+    change stream, so they survive a restart
+    """
+
+    def __init__(
+        self,
+        collection_name: str = 'resume_tokens',
+        alias: str = DEFAULT_CONNECTION_NAME,
+    ) -> None:
+        self.collection_name = collection_name
+        self.alias = alias
+
+    @property
+    def collection(self):
+        return get_db(self.alias)[self.collection_name]
+
+    async def load(self, name: str) -> Optional[Dict]:
+        stored = await create_awaitable(
+            self.collection.find_one, {'_id': name}
+        )
+        return stored['token'] if stored else None
+
+    async def save(self, name: str, token: Dict) -> None:
+        await create_write_awaitable(
+            self.collection.replace_one,
+            {'_id': name},
+            {'_id': name, 'token': token},
+            upsert=True,
+        )
+
+
+def next_changes(stream: Any) -> List[Dict]:
+    """
+    Returns the changes of the next batch of a pymongo change stream. It
+    waits up to the `max_await_time_ms` of the stream and returns an empty
+    list if nothing changed
+    """
+    changes = []
+    change = stream.try_next()
+    while change is not None:
+        changes.append(change)
+        if not buffered(stream._cursor):
+            break
+        change = stream.try_next()
+    return changes
+
+
+async def _motor_next_changes(stream: Any) -> List[Dict]:
+    changes = []
+    change = await stream.try_next()
+    while change is not None:
+        changes.append(change)
+        if not buffered(stream.delegate._cursor):
+            break
+        change = await stream.try_next()
+    return changes
+
+
+async def watch(
+    document: Any,
+    pipeline: Optional[List[Dict]] = None,
+    full_document: Optional[str] = None,
+    resume_after: Optional[Dict] = None,
+    start_after: Optional[Dict] = None,
+    max_await_time_ms: int = WATCH_MAX_AWAIT_TIME_MS,
+    batch_size: Optional[int] = None,
+    token_store: Optional[ResumeTokenStore] = None,
+    name: Optional[str] = None,
+) -> AsyncIterator[ChangeEvent]:
+    name = name or document._get_collection_name()
+    if token_store and not resume_after and not start_after:
+        resume_after = await token_store.load(name)
+
+    collection = document._get_collection()
+    options = dict(
+        pipeline=pipeline,
+        full_document=full_document,
+        resume_after=resume_after,
+        start_after=start_after,
+        max_await_time_ms=max_await_time_ms,
+        batch_size=batch_size,
+    )
+    with_motor = motor_enabled()
+    if with_motor:
+        alias = document._meta.get('db_alias', DEFAULT_CONNECTION_NAME)
+        stream = get_motor_collection(collection, alias).watch(**options)
+    else:
+        stream = await create_awaitable(collection.watch, **options)
+
+    try:
+        while True:
+            if with_motor:
+                changes = await _motor_next_changes(stream)
+            else:
+                changes = await create_awaitable(next_changes, stream)
+
+            full_documents = [
+                change['fullDocument']
+                for change in changes
+                if change.get('fullDocument')
+            ]
+            await async_decrypt_documents(document, full_documents)
+            for change in changes:
+                yield ChangeEvent(
+                    change['operationType'],
+                    change.get('documentKey'),
+                    _from_son(document, change.get('fullDocument')),
+                    change.get('updateDescription'),
+                    change,
+                )
+            # saved once the whole batch was processed
+            if token_store and changes:
+                await token_store.save(name, stream.resume_token)
+    finally:
+        if with_motor:
+            await stream.close()
+        else:
+            await create_awaitable(stream.close)
+
+
+def _from_son(document: Any, son: Optional[Dict]) -> Any:
+    return document._from_son(son) if son else None
@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from mongoengine import get_connection
+
+READ = 'read'
+WRITE = 'write'
+
+THREAD_NAME_PREFIX = 'mongoengine-plus-aio'
+
+
+class ExecutorStats(NamedTuple):
+    max_workers: int
+    max_queue: int
+    queued: int
+    running: int
+    submitted: int
+    completed: int
+    total_wait: float
+    max_wait: float
+
+
+class AioExecutor:
+    """
+    Thread pool that runs the pymongo calls of `mongoengine_plus.aio`.
+    At most `max_workers + max_queue` calls are pending at once, the next
+    ones wait for a slot instead of queueing without bound. The wait is
+    measured from the call until a thread starts running it
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_queue: int,
+        thread_name_prefix: str = THREAD_NAME_PREFIX,
+    ) -> None:
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=thread_name_prefix
+        )
+        self._lock = Lock()
+        # asyncio semaphores belong to a single event loop
+        self._slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._queued = 0
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        called_at = time.monotonic()
+        slots = self._loop_slots()
+        await slots.acquire()
+        try:
+            future = self._submit(called_at, partial(func, *args, **kwargs))
+        except BaseException:
+            slots.release()
+            raise
+        # the slot is released once the call is done, a cancelled caller
+        # doesn't free it while a thread still runs the call
+        future.add_done_callback(
+            partial(_release_slot, asyncio.get_running_loop(), slots)
+        )
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # it never ran, so it's no longer queued
+            if future.cancel():
+                with self._lock:
+                    self._queued -= 1
+            raise
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Runs `func` without waiting for a slot and without being cancelled
+        with the caller, for cleanups like closing a cursor
+        """
+        return self._submit(time.monotonic(), partial(func, *args, **kwargs))
+
+    def stats(self) -> ExecutorStats:
+        with self._lock:
+            return ExecutorStats(
+                self.max_workers,
+                self.max_queue,
+                self._queued,
+                self._running,
+                self._submitted,
+                self._completed,
+                self._total_wait,
+                self._max_wait,
+            )
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def _loop_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots[loop] = asyncio.Semaphore(
+                self.max_workers + self.max_queue
+            )
+        return slots
+
+    def _submit(self, called_at: float, func: Callable) -> Future:
+        with self._lock:
+            self._queued += 1
+            self._submitted += 1
+        # the call sees the context variables of the task, like the session
+        # of its transaction
+        context = contextvars.copy_context()
+        return self._executor.submit(
+            self._call, called_at, partial(context.run, func)
+        )
+
+    def _call(self, called_at: float, func: Callable) -> Any:
+        wait = time.monotonic() - called_at
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+
+def _release_slot(
+    loop: asyncio.AbstractEventLoop, slots: asyncio.Semaphore, _: Future
+) -> None:
+    try:
+        loop.call_soon_threadsafe(slots.release)
+    except RuntimeError:
+        # the loop is closed, and its slots with it
+        pass
+
+
+_executors: Dict[str, AioExecutor] = {}
+
+
+def configure_executor(
+    max_workers: Optional[int] = None,
+    max_queue: Optional[int] = None,
+    write_workers: Optional[int] = None,
+) -> None:
+    """
+    Sets the thread pool the aio methods run pymongo calls in, instead of
+    the event loop's default executor. `max_workers` defaults to the
+    `maxPoolSize` of the default connection and `max_queue` to
+    `max_workers`. With `write_workers` writes get a pool of their own
+    """
+    global _executors
+    if max_workers is None:
+        max_workers = get_connection().options.pool_options.max_pool_size
+    if max_queue is None:
+        max_queue = max_workers
+
+    reads = AioExecutor(max_workers, max_queue)
+    writes = reads
+    if write_workers:
+        writes = AioExecutor(
+            write_workers, max_queue, f'{THREAD_NAME_PREFIX}-write'
+        )
+    previous, _executors = _executors, {READ: reads, WRITE: writes}
+    for executor in set(previous.values()):
+        executor.shutdown(wait=False)
+
+
+def get_executor(kind: str = READ) -> AioExecutor:
+    if not _executors:
+        configure_executor()
+    return _executors[kind]
+
+
+def executor_stats(kind: str = READ) -> ExecutorStats:
+    return get_executor(kind).stats()
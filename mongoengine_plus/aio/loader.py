@@ -0,0 +1,94 @@
+import asyncio
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+class DataLoader:
+    """
+    Coalesces the documents requested with `load` in the same iteration
+    of the event loop into one `async_in_bulk` query. Loaded documents are
+    cached, so create one loader per request. Ids that don't exist resolve
+    to `None`
+    """
+
+    def __init__(self, queryset, max_batch_size: Optional[int] = None):
+        self.queryset = queryset
+        self.max_batch_size = max_batch_size
+        document = queryset._document
+        self._pk_field = document._fields[document._meta['id_field']]
+        self._cache: Dict[Any, asyncio.Future] = {}
+        self._batch: List[Tuple[Any, asyncio.Future]] = []
+        self._tasks: Set[asyncio.Task] = set()
+
+    def load(self, pk: Any) -> asyncio.Future:
+        key = self._pk_field.to_python(pk)
+        future = self._cache.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._cache[key] = loop.create_future()
+            future.add_done_callback(partial(self._done, key))
+            if not self._batch:
+                loop.call_soon(self._dispatch)
+            self._batch.append((key, future))
+        # the future is shared, cancelling one of its awaiters mustn't
+        # cancel the others
+        return asyncio.shield(future)
+
+    async def load_many(self, pks: List[Any]) -> List[Any]:
+        return await asyncio.gather(*[self.load(pk) for pk in pks])
+
+    def prime(self, document: Any) -> None:
+        key = document.pk
+        if key not in self._cache:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(document)
+            self._cache[key] = future
+
+    def clear(self, pk: Any = None) -> None:
+        if pk is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(self._pk_field.to_python(pk), None)
+
+    def _dispatch(self) -> None:
+        batch, self._batch = self._batch, []
+        size = self.max_batch_size or len(batch)
+        for start in range(0, len(batch), size):
+            end = start + size
+            chunk = batch[start:end]
+            task = asyncio.ensure_future(self._fetch(chunk))
+            # the loop only keeps weak references to its tasks
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(partial(self._fetched, chunk))
+
+    async def _fetch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            documents = await self.queryset.async_in_bulk(
+                [key for key, _ in batch]
+            )
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for key, future in batch:
+            if not future.done():
+                future.set_result(documents.get(key))
+
+    def _fetched(
+        self, batch: List[Tuple[Any, asyncio.Future]], task: asyncio.Task
+    ) -> None:
+        # a task cancelled before it starts doesn't run `_fetch` at all
+        if task.cancelled():
+            for _, future in batch:
+                future.cancel()
+
+    def _done(self, key: Any, future: asyncio.Future) -> None:
+        # failed and cancelled loads aren't cached, so they can be loaded
+        # again. Retrieving the exception also keeps asyncio from logging
+        # it when no awaiter is left
+        if future.cancelled() or future.exception() is not None:
+            if self._cache.get(key) is future:
+                del self._cache[key]
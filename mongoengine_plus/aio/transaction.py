@@ -0,0 +1,166 @@
+import asyncio
+import inspect
+import random
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from mongoengine import get_connection
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+from mongoengine.errors import OperationError
+from pymongo.client_session import ClientSession
+from pymongo.errors import PyMongoError
+
+from .utils import create_write_awaitable
+
+# same limit as pymongo's ClientSession.with_transaction
+TRANSACTION_TIMEOUT = 120
+TRANSACTION_BACKOFF = 0.01
+TRANSACTION_MAX_BACKOFF = 1.0
+
+_session: ContextVar[Optional[ClientSession]] = ContextVar(
+    'mongoengine_plus_session', default=None
+)
+
+
+def current_session() -> Optional[ClientSession]:
+    return _session.get()
+
+
+class SessionCollection:
+    """
+    Proxy of a pymongo collection that passes `session` to every method
+    that accepts it
+    """
+
+    _accepts_session: Dict[str, bool] = {}
+
+    def __init__(self, collection: Any, session: ClientSession) -> None:
+        self.collection = collection
+        self.session = session
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.collection, name)
+        if name == 'with_options':
+            return lambda *args, **kwargs: SessionCollection(
+                attr(*args, **kwargs), self.session
+            )
+        if not self._with_session(name, attr):
+            return attr
+
+        def call(*args, **kwargs):
+            kwargs.setdefault('session', self.session)
+            return attr(*args, **kwargs)
+
+        return call
+
+    @classmethod
+    def _with_session(cls, name: str, attr: Any) -> bool:
+        if name not in cls._accepts_session:
+            try:
+                parameters = inspect.signature(attr).parameters
+            except (TypeError, ValueError):
+                parameters = {}  # type: ignore[assignment]
+            cls._accepts_session[name] = 'session' in parameters
+        return cls._accepts_session[name]
+
+
+def bind_session(collection: Any) -> Any:
+    """
+    Returns `collection` bound to the session of the running transaction,
+    if there's one for its client
+    """
+    if isinstance(collection, SessionCollection):
+        collection = collection.collection
+    session = current_session()
+    if session is None or session.client is not collection.database.client:
+        return collection
+    return SessionCollection(collection, session)
+
+
+@asynccontextmanager
+async def async_transaction(
+    alias: str = DEFAULT_CONNECTION_NAME, **options
+) -> AsyncIterator[ClientSession]:
+    """
+    Runs the aio operations of the block in a transaction of the connection
+    `alias`. The session is kept in a context variable, so it follows the
+    task into the executor threads. It's committed when the block ends and
+    aborted if it raises. Nested blocks are part of the outer transaction.
+    `options` go to `ClientSession.start_transaction`
+    """
+    client = get_connection(alias)
+    session = current_session()
+    if session is not None:
+        if session.client is not client:
+            raise OperationError(
+                'Nested transactions must use the same connection'
+            )
+        yield session
+        return
+
+    session = await create_write_awaitable(client.start_session)
+    session.start_transaction(**options)
+    token = _session.set(session)
+    try:
+        try:
+            yield session
+        except BaseException:
+            if session.in_transaction:
+                await create_write_awaitable(session.abort_transaction)
+            raise
+        await _commit(session, time.monotonic() + TRANSACTION_TIMEOUT)
+    finally:
+        _session.reset(token)
+        session.end_session()
+
+
+async def async_run_in_transaction(
+    callback: Callable[[], Awaitable[Any]],
+    alias: str = DEFAULT_CONNECTION_NAME,
+    timeout: float = TRANSACTION_TIMEOUT,
+    **options,
+) -> Any:
+    """
+    Awaits `callback()` in `async_transaction` and runs it again, after a
+    backoff, while it fails with a `TransientTransactionError`, for up to
+    `timeout` seconds. Inside another transaction it's only awaited, the
+    outer one has to be retried instead
+    """
+    if current_session() is not None:
+        return await callback()
+
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        try:
+            async with async_transaction(alias, **options):
+                return await callback()
+        except PyMongoError as error:
+            if not error.has_error_label('TransientTransactionError'):
+                raise
+            if time.monotonic() >= deadline:
+                raise
+        await asyncio.sleep(_backoff(attempt))
+        attempt += 1
+
+
+async def _commit(session: ClientSession, deadline: float) -> None:
+    attempt = 0
+    while True:
+        try:
+            await create_write_awaitable(session.commit_transaction)
+            return
+        except PyMongoError as error:
+            if not error.has_error_label('UnknownTransactionCommitResult'):
+                raise
+            if time.monotonic() >= deadline:
+                raise
+        await asyncio.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def _backoff(attempt: int) -> float:
+    delay = min(TRANSACTION_MAX_BACKOFF, TRANSACTION_BACKOFF * 2**attempt)
+    return delay * random.random()
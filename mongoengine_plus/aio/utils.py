@@ -1,8 +1,53 @@
 import asyncio
-from functools import partial
-from typing import Any, Callable
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ..cursor import next_batch
+from .executor import READ, WRITE, get_executor
 
 
 async def create_awaitable(func: Callable, *args, **kwargs) -> Any:
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+    return await get_executor(READ).run(func, *args, **kwargs)
+
+
+async def create_write_awaitable(func: Callable, *args, **kwargs) -> Any:
+    return await get_executor(WRITE).run(func, *args, **kwargs)
+
+
+async def with_timeout(awaitable: Awaitable, timeout: Optional[float]) -> Any:
+    """
+    Awaits `awaitable` for up to `timeout` seconds, it's cancelled and
+    `asyncio.TimeoutError` is raised after that
+    """
+    if timeout is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, timeout)
+
+
+def to_max_time_ms(timeout: Optional[float]) -> Optional[int]:
+    if timeout is None:
+        return None
+    return max(1, int(timeout * 1000))
+
+
+class ExecutorCursor:
+    """
+    Fetches the batches of a pymongo cursor in the executor. Cursors aren't
+    thread-safe, so `close` waits in the executor for the batch being
+    fetched, if any, before killing the cursor on the server
+    """
+
+    def __init__(self, cursor: Any) -> None:
+        self.cursor = cursor
+        self._lock = Lock()
+
+    async def next_batch(self) -> List[Dict]:
+        return await create_awaitable(self._locked, next_batch, self.cursor)
+
+    def close(self) -> None:
+        if self.cursor.alive:
+            get_executor(READ).submit(self._locked, self.cursor.close)
+
+    def _locked(self, func: Callable, *args) -> Any:
+        with self._lock:
+            return func(*args)
@@ -0,0 +1,28 @@
+from typing import Any, Dict, List
+
+
+def buffered(cursor: Any) -> int:
+    """
+    Returns the number of documents a pymongo cursor or command cursor
+    already fetched and hasn't returned yet
+    """
+    for attribute in ('_Cursor__data', '_CommandCursor__data'):
+        data = getattr(cursor, attribute, None)
+        if data is not None:
+            return len(data)
+    return 0
+
+
+def next_batch(cursor: Any) -> List[Dict]:
+    """
+    Returns the documents of the next batch of a pymongo cursor or command
+    cursor, an empty list once the cursor is exhausted
+    """
+    try:
+        raw_docs = [next(cursor)]
+    except StopIteration:
+        return []
+    # the rest of the batch the driver already fetched with this call
+    while buffered(cursor):
+        raw_docs.append(next(cursor))
+    return raw_docs
@@ -1,4 +1,5 @@
-__all__ = ['BaseModel', 'uuid_field']
+__all__ = ['BaseModel', 'BaseQuerySet', 'uuid_field']
 
 from .base import BaseModel
 from .helpers import uuid_field
+from .query_set import BaseQuerySet
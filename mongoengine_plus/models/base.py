@@ -1,23 +1,96 @@
-from typing import ClassVar, Dict
+from typing import Any, ClassVar, Dict, Iterable, Mapping, Optional
 
-from .helpers import mongo_to_dict
+from mongoengine.base import BaseDocument
+
+from .helpers import DictCache, Serializer
 
 
 class BaseModel:
     _excluded: ClassVar = []
     _hidden: ClassVar = []
+    _dict_cache: Optional[DictCache] = None
 
     def __init__(self, *args, **values):
         return super().__init__(*args, **values)
 
-    def to_dict(self) -> Dict:
-        private_fields = [f for f in dir(self) if f.startswith('_')]
-        excluded = self._excluded + private_fields
-        mongo_dict: dict = mongo_to_dict(self, excluded)
+    @classmethod
+    def _serializer(cls) -> Serializer:
+        # compiled the first time each class is serialized and again after
+        # a field converter is registered
+        serializer = cls.__dict__.get('_compiled_serializer')
+        if serializer is None or serializer.outdated():
+            # hidden fields are masked, there's no need to serialize them
+            serializer = Serializer(
+                cls,
+                exclude=cls._excluded,
+                hidden=cls._hidden,
+                exclude_private=True,
+            )
+            setattr(cls, '_compiled_serializer', serializer)
+        return serializer
+
+    def to_dict(
+        self, only: Optional[Iterable[str]] = None, exclude: Iterable[str] = ()
+    ) -> Dict:
+        """
+        Serializes the fields in `only`, or all of them, except the ones in
+        `exclude`. Use dotted paths for the fields of embedded documents
+        """
+        serializer = self._serializer()
+        if only is not None or exclude:
+            serializer = serializer.project(only, exclude)
+        return serializer(self)
+
+    def cached_dict(self) -> Mapping[str, Any]:
+        """
+        Returns `to_dict` as a read-only mapping kept in the instance, with
+        tuples instead of lists. The next calls only serialize again the
+        fields that changed since, as mongoengine tracks them to save the
+        changes, and all of them after `reload`
+        """
+        cache = self._dict_cache
+        if cache is not None and not cache.serializer.outdated():
+            return cache.read(self)
+        cache = DictCache(self._serializer(), self)
+        # the hooks below only run if BaseModel is before the mongoengine
+        # classes, e.g. `class User(BaseModel, Document)`
+        mro = type(self).__mro__
+        if mro.index(BaseModel) < mro.index(BaseDocument):
+            self._dict_cache = cache
+        return cache.view
+
+    def _mark_as_changed(self, key):
+        cache = self._dict_cache
+        if cache is not None and key:
+            field_name = key.split('.', 1)[0]
+            cache.changed.add(
+                self._reverse_db_field_map.get(field_name, field_name)
+            )
+        super()._mark_as_changed(key)
+
+    def _clear_changed_fields(self):
+        # the changes of the embedded documents are cleared once saved
+        if self._dict_cache is not None:
+            self._dict_cache.add_nested_changes(self)
+        super()._clear_changed_fields()
+
+    def reload(self, *fields, **kwargs):
+        self._dict_cache = None
+        return super().reload(*fields, **kwargs)
 
-        for field in self._hidden:
-            mongo_dict[field] = '********'
-        return mongo_dict
+    def to_json_bytes(
+        self, only: Optional[Iterable[str]] = None, exclude: Iterable[str] = ()
+    ) -> bytes:
+        """
+        Returns `to_dict` encoded as JSON, written straight from the
+        serializer without building the dict
+        """
+        serializer = self._serializer()
+        if only is not None or exclude:
+            serializer = serializer.project(only, exclude)
+        buffer = bytearray()
+        serializer.write_json(self, buffer)
+        return bytes(buffer)
 
     def __repr__(self) -> str:
         return str(self.to_dict())  # pragma: no cover
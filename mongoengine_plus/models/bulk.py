@@ -0,0 +1,130 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+import pymongo
+from mongoengine import Document, Q
+from mongoengine.errors import OperationError
+from mongoengine.queryset import transform
+
+from ..types.enum_field import expand_enum_update
+
+# operations sent in each `bulk_write` call. pymongo splits every call in
+# batches under the server's maxWriteBatchSize and maxMessageSizeBytes
+BULK_WRITE_CHUNK_SIZE = 100_000
+
+
+class BulkOperation(ABC):
+    @abstractmethod
+    def to_pymongo(self, queryset) -> Any:
+        """The pymongo request of the operation for `queryset`"""
+
+    def written(self) -> None:
+        """Called once the operation has been written"""
+
+
+class Insert(BulkOperation):
+    """
+    Inserts `document`, once it's written its `pk` is set and its changes
+    cleared, as `save` does. Signals aren't sent
+    """
+
+    def __init__(self, document: Document) -> None:
+        self.document = document
+        self.son: Optional[Dict] = None
+
+    def to_pymongo(self, queryset) -> pymongo.InsertOne:
+        self.document.validate()
+        self.son = self.document.to_mongo()
+        return pymongo.InsertOne(self.son)
+
+    def written(self) -> None:
+        if self.son is not None and '_id' in self.son:
+            self.document.pk = self.son['_id']
+            self.document._clear_changed_fields()
+            self.document._created = False
+
+
+class UpdateOne(BulkOperation):
+    """
+    Updates the first document that matches `q` with mongoengine's update
+    syntax, e.g. `UpdateOne(Q(name='Jane'), inc__visits=1, upsert=True)`
+    """
+
+    multi = False
+
+    def __init__(
+        self,
+        q: Optional[Q] = None,
+        upsert: bool = False,
+        array_filters: Optional[List[Dict]] = None,
+        **update,
+    ) -> None:
+        if not update and not upsert:
+            raise OperationError('No update parameters, would remove data')
+        self.q = q
+        self.upsert = upsert
+        self.array_filters = array_filters
+        self.update = update
+
+    def to_pymongo(self, queryset) -> Any:
+        query = queryset._bulk_query(self.q)
+        update = expand_enum_update(
+            queryset._document,
+            transform.update(queryset._document, **self.update),
+        )
+        # upserts of inheritable classes need the _cls
+        if self.upsert and '_cls' in query:
+            class_name = queryset._document._class_name
+            update.setdefault('$set', {})['_cls'] = class_name
+        operation = pymongo.UpdateMany if self.multi else pymongo.UpdateOne
+        return operation(
+            query,
+            update,
+            upsert=self.upsert,
+            array_filters=self.array_filters,
+        )
+
+
+class UpdateMany(UpdateOne):
+    multi = True
+
+
+class DeleteOne(BulkOperation):
+    multi = False
+
+    def __init__(self, q: Optional[Q] = None) -> None:
+        self.q = q
+
+    def to_pymongo(self, queryset) -> Any:
+        operation = pymongo.DeleteMany if self.multi else pymongo.DeleteOne
+        return operation(queryset._bulk_query(self.q))
+
+
+class DeleteMany(DeleteOne):
+    multi = True
+
+
+def merge_bulk_results(totals: Dict, result: Dict, offset: int) -> None:
+    """
+    Adds the `bulk_api_result` of a chunk to `totals`, moving the indexes
+    of its upserts and errors by the `offset` of the chunk
+    """
+    for key in ('nInserted', 'nUpserted', 'nMatched', 'nModified', 'nRemoved'):
+        totals[key] += result.get(key, 0)
+    for key in ('upserted', 'writeErrors'):
+        for item in result.get(key, []):
+            totals[key].append(dict(item, index=item['index'] + offset))
+    totals['writeConcernErrors'].extend(result.get('writeConcernErrors', []))
+
+
+def empty_bulk_result() -> Dict:
+    return dict(
+        nInserted=0,
+        nUpserted=0,
+        nMatched=0,
+        nModified=0,
+        nRemoved=0,
+        upserted=[],
+        writeErrors=[],
+        writeConcernErrors=[],
+    )
@@ -0,0 +1,119 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from json.encoder import encode_basestring
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator
+
+from bson import ObjectId
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+# Fragment, to write decimals as they are, was added in orjson 3.9
+FAST_ENCODER = orjson is not None and hasattr(orjson, 'Fragment')
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def encode_json(data: Any) -> bytes:
+    """
+    Encodes the dicts `to_dict` returns as compact UTF-8 JSON, with orjson
+    if it's installed. Datetimes are written in ISO format and enums as
+    their values. orjson writes decimals as numbers with the same digits,
+    the json module as floats
+    """
+    if FAST_ENCODER:
+        return orjson.dumps(
+            data, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS
+        )
+    return _stdlib_encoder.encode(data).encode()
+
+
+def encode_json_value(value: Any) -> bytes:
+    """
+    Encodes a value with the json module, strings, integers, booleans and
+    None without it
+    """
+    value_type = type(value)
+    if value_type is str:
+        return encode_basestring(value).encode()
+    if value is None:
+        return b'null'
+    if value_type is bool:
+        return b'true' if value else b'false'
+    if value_type is int:
+        return int.__repr__(value).encode()
+    return _stdlib_encoder.encode(value).encode()
+
+
+def iter_json_array(
+    dicts: Iterable[Dict], chunk_size: int = JSON_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Encodes `dicts` as a JSON array in chunks of about `chunk_size` bytes
+    """
+    buffer = bytearray(b'[')
+    separator = b''
+    for data in dicts:
+        buffer += separator
+        buffer += encode_json(data)
+        separator = b','
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+
+async def async_iter_json_array(
+    dicts: AsyncIterator[Dict], chunk_size: int = JSON_CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    buffer = bytearray(b'[')
+    separator = b''
+    async for data in dicts:
+        buffer += separator
+        buffer += encode_json(data)
+        separator = b','
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+
+def _json_value(value: Any) -> Any:
+    # values of DictFields aren't converted by `to_dict`
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, MappingProxyType):
+        # `cached_dict` views
+        return dict(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _orjson_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return orjson.Fragment(  # type: ignore[attr-defined]
+            str(value).encode()
+        )
+    return _json_value(value)
+
+
+def _stdlib_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    return _json_value(value)
+
+
+# what `json.dumps` builds on each call with these options
+_stdlib_encoder = json.JSONEncoder(
+    ensure_ascii=False, separators=(',', ':'), default=_stdlib_default
+)
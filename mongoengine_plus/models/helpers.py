@@ -1,7 +1,21 @@
 # mypy: ignore-errors
+import copy
 import uuid
 from base64 import urlsafe_b64encode
 from enum import Enum
+from types import MappingProxyType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
 
 from bson import DBRef
 from mongoengine import (
@@ -13,14 +27,24 @@ from mongoengine import (
     Document,
     EmbeddedDocument,
     EmbeddedDocumentField,
-    FloatField,
+    GenericEmbeddedDocumentField,
     GenericLazyReferenceField,
     IntField,
     LazyReferenceField,
     ListField,
 )
+from mongoengine.base import ComplexBaseField
+
+from ..types import EncryptedStringField, EnumField
+from ..types.encrypted_string.cache import LRUCache
+from ..types.encrypted_string.fields import is_ciphertext
+from . import encoder
+from .encoder import encode_json, encode_json_value
 
-from ..types import EnumField
+HIDDEN_VALUE = '********'
+HIDDEN_JSON = encode_json(HIDDEN_VALUE)
+# projections kept by each serializer, the least recently used are dropped
+PROJECTIONS_CACHE_SIZE = 128
 
 
 def uuid_field(prefix: str = ''):
@@ -30,102 +54,576 @@ def uuid_field(prefix: str = ''):
     return base64_uuid_func
 
 
-def mongo_to_dict(obj, exclude_fields: list = None) -> dict:
+class Serializer:
     """
-    from: https://gist.github.com/jason-w/4969476
+    Converts documents of one class to dicts. The fields to serialize,
+    their output keys and the converter of each field only depend on the
+    class, so they're computed once and `__call__` is a tight loop.
+
+    `from_son` builds the same dict from the raw document read from
+    MongoDB, without creating the document instance, and `write_json`
+    encodes it without building it. `project` returns a serializer of only
+    some of the fields.
     """
-    return_data = {}
 
-    if obj is None:
-        return return_data
+    def __init__(
+        self,
+        document: type,
+        exclude: Iterable[str] = (),
+        hidden: Iterable[str] = (),
+        exclude_private: bool = False,
+    ) -> None:
+        exclude = set(exclude) | {'id', '_cls'}
+        hidden = tuple(hidden)
+        self.with_id = issubclass(document, Document)
+        self.id_field = document._fields.get('id')
+        self.fields: List[Tuple[str, str, Callable, bool]] = []
+        self.son_fields: List[Tuple[str, str, Callable, Any]] = []
+        self.encrypted_fields: List[EncryptedStringField] = []
+        self._projections = LRUCache(PROJECTIONS_CACHE_SIZE)
+        # `write_json` encodes the keys the first time it runs
+        self._json_fields: Optional[List[Tuple]] = None
+        self._json_hidden = b''
+        self.converters_version = _converters_version
+        for field_name, field in document._fields.items():
+            if field_name in exclude or (
+                exclude_private and field_name.startswith('_')
+            ):
+                continue
+            if field_name in hidden:
+                # masked in its position, its value is never read
+                self.fields.append(
+                    (field_name, field_name, _hidden_value, False)
+                )
+                self.son_fields.append(
+                    (field.db_field, field_name, _hidden_value, field)
+                )
+                continue
+            key, converter = field_converter(field_name, field)
+            # lazy encrypted values are decrypted on attribute access
+            from_attribute = isinstance(field, EncryptedStringField)
+            self.fields.append((field_name, key, converter, from_attribute))
+            self.son_fields.append((field.db_field, key, converter, field))
+            if from_attribute:
+                self.encrypted_fields.append(field)
+        # hidden names that aren't serialized fields go at the end
+        placed = {field_name for field_name, *_ in self.fields}
+        self.hidden = tuple(key for key in hidden if key not in placed)
 
-    if isinstance(obj, Document):
-        return_data['id'] = str(obj.id)
+    def __call__(self, obj) -> dict:
+        return_data = {}
+        if self.with_id:
+            return_data['id'] = str(obj.id)
 
-    if exclude_fields is None:
-        exclude_fields = []
+        data = obj._data
+        for field_name, key, converter, from_attribute in self.fields:
+            value = (
+                getattr(obj, field_name)
+                if from_attribute
+                else data[field_name]
+            )
+            return_data[key] = converter(value)
 
-    # remove _cls from heritage embedded fields
+        for key in self.hidden:
+            return_data[key] = HIDDEN_VALUE
+        return return_data
 
-    exclude_fields.append('_cls')
-    for field_name in obj._fields:
+    def write_json(self, obj, buffer: bytearray) -> None:
+        """
+        Appends the dict `__call__` returns, encoded as JSON, to `buffer`.
+        Without orjson each value is encoded as it's converted and the keys
+        once per serializer, orjson encodes the whole dict faster
+        """
+        if encoder.FAST_ENCODER:
+            buffer += encode_json(self(obj))
+            return
+        if self._json_fields is None:
+            self._compile_json()
+        start = len(buffer)
+        if self.with_id:
+            buffer += b',"id":'
+            buffer += encode_json_value(str(obj.id))
 
-        if field_name in exclude_fields:
-            continue
+        data = obj._data
+        for (
+            field_name,
+            json_key,
+            converter,
+            from_attribute,
+        ) in self._json_fields:
+            value = (
+                getattr(obj, field_name)
+                if from_attribute
+                else data[field_name]
+            )
+            buffer += json_key
+            buffer += encode_json_value(converter(value))
 
-        if field_name == 'id':
-            continue
-        data = obj._data[field_name]
-        if isinstance(obj._fields[field_name], ListField):
-            field_name = (
-                f'{field_name}_uris'
-                if isinstance(
-                    obj._fields[field_name].field, LazyReferenceField
-                )
-                else field_name
+        buffer += self._json_hidden
+        if len(buffer) == start:
+            buffer += b'{}'
+        else:
+            # every member was written after a comma
+            buffer[start] = ord('{')
+            buffer += b'}'
+
+    def _compile_json(self) -> None:
+        self._json_fields = [
+            (field_name, b',' + encode_json(key) + b':', converter, attr)
+            for field_name, key, converter, attr in self.fields
+        ]
+        self._json_hidden = b''.join(
+            b',' + encode_json(key) + b':' + HIDDEN_JSON for key in self.hidden
+        )
+
+    def convert(self, obj, names: Set[str]) -> Iterator[Tuple[str, Any]]:
+        """
+        Yields the keys and values of the fields in `names` only
+        """
+        if self.with_id and 'id' in names:
+            yield 'id', str(obj.id)
+        data = obj._data
+        for field_name, key, converter, from_attribute in self.fields:
+            if field_name not in names:
+                continue
+            value = (
+                getattr(obj, field_name)
+                if from_attribute
+                else data[field_name]
             )
-            return_data[field_name] = list_field_to_dict(data)
-        elif isinstance(obj._fields[field_name], EmbeddedDocumentField):
-            if callable(getattr(data, "to_dict", None)):
-                return_data[field_name] = data.to_dict()
+            yield key, converter(value)
+
+    def from_son(self, son: dict) -> dict:
+        return_data = {}
+        if self.with_id:
+            pk = son.get('_id')
+            if pk is not None and self.id_field is not None:
+                pk = self.id_field.to_python(pk)
+            return_data['id'] = str(pk)
+
+        for db_field, key, converter, field in self.son_fields:
+            if converter is _hidden_value:
+                return_data[key] = HIDDEN_VALUE
+                continue
+            value = son.get(db_field)
+            if value is None:
+                value = _default(field)
             else:
-                return_data[field_name] = mongo_to_dict(data)
-        elif isinstance(obj._fields[field_name], DictField):
-            return_data[field_name] = data
-        elif isinstance(obj._fields[field_name], EnumField):
-            return_data[field_name] = data.value if data is not None else None
-        elif isinstance(obj._fields[field_name], LazyReferenceField):
-            return_data[f'{field_name}_uri'] = (
-                f'/{data._DBRef__collection}/{data.id}' if data else None
+                value = field.to_python(value)
+                if is_ciphertext(value):
+                    # lazy fields or values that weren't decrypted in bulk
+                    value = field.client_encryption.decrypt(value)
+            return_data[key] = converter(value)
+
+        for key in self.hidden:
+            return_data[key] = HIDDEN_VALUE
+        return return_data
+
+    def outdated(self) -> bool:
+        """Whether field converters were registered after it was compiled"""
+        return self.converters_version != _converters_version
+
+    def project(
+        self, only: Optional[Iterable[str]] = None, exclude: Iterable[str] = ()
+    ) -> 'Serializer':
+        """
+        Returns a serializer of the fields in `only`, or all of them, except
+        the ones in `exclude`. Both take field names, with dotted paths for
+        the fields of embedded documents, also of the ones in lists. Names
+        that aren't fields are ignored. `id` is included unless excluded
+        """
+        only = None if only is None else tuple(sorted(set(only)))
+        exclude = tuple(sorted(set(exclude)))
+        return self._projections.get_or_set(
+            (only, exclude),
+            lambda: self._project(
+                None if only is None else field_tree(only),
+                field_tree(exclude),
+            ),
+        )
+
+    def _project(self, only: Optional[Dict], exclude: Dict) -> 'Serializer':
+        projected = copy.copy(self)
+        projected._projections = LRUCache(PROJECTIONS_CACHE_SIZE)
+        projected._json_fields = None
+        projected.with_id = self.with_id and exclude.get('id') is not True
+        projected.hidden = tuple(
+            key for key in self.hidden if _included(key, only, exclude)
+        )
+        projected.fields = []
+        projected.son_fields = []
+        projected.encrypted_fields = []
+        for entry, son_entry in zip(self.fields, self.son_fields):
+            field_name, key, converter, from_attribute = entry
+            if not _included(field_name, only, exclude):
+                continue
+            field = son_entry[3]
+            # the fields of the embedded documents of this field, if any
+            field_only = None if only is None else only[field_name]
+            if field_only is True:
+                field_only = None
+            field_exclude = exclude.get(field_name) or {}
+            if converter is not _hidden_value and (
+                field_only is not None or field_exclude
+            ):
+                converter = _projected_converter(
+                    field, converter, field_only, field_exclude
+                )
+            projected.fields.append(
+                (field_name, key, converter, from_attribute)
             )
-        elif isinstance(obj._fields[field_name], GenericLazyReferenceField):
-            return_data[f'{field_name}_uri'] = (
-                f'/{data["_ref"]._DBRef__collection}/{data["_ref"].id}'
-                if data
-                else None
+            projected.son_fields.append((son_entry[0], key, converter, field))
+            if from_attribute:
+                projected.encrypted_fields.append(field)
+        return projected
+
+
+class DictCache:
+    """
+    Read-only copy of the dict a serializer returns for a document. The
+    fields in `changed` and the ones whose embedded documents changed are
+    converted again when it's read, the others are reused
+    """
+
+    def __init__(self, serializer: Serializer, obj) -> None:
+        self.serializer = serializer
+        self.changed: Set[str] = set()
+        # embedded documents track their own changes, not the document's
+        self.nested = [
+            field_name
+            for (field_name, *_), son_entry in zip(
+                serializer.fields, serializer.son_fields
             )
+            if _may_embed(son_entry[3])
+        ]
+        self.data = {
+            key: _freeze(value) for key, value in serializer(obj).items()
+        }
+        self.view: Mapping[str, Any] = MappingProxyType(self.data)
+
+    def read(self, obj) -> Mapping[str, Any]:
+        self.add_nested_changes(obj)
+        if self.changed:
+            changed, self.changed = self.changed, set()
+            for key, value in self.serializer.convert(obj, changed):
+                self.data[key] = _freeze(value)
+        return self.view
+
+    def add_nested_changes(self, obj) -> None:
+        data = obj._data
+        for field_name in self.nested:
+            if field_name not in self.changed and _has_changes(
+                data.get(field_name)
+            ):
+                self.changed.add(field_name)
+
+
+def _may_embed(field) -> bool:
+    if isinstance(
+        field, (EmbeddedDocumentField, GenericEmbeddedDocumentField)
+    ):
+        return True
+    if isinstance(field, ComplexBaseField):
+        return field.field is None or _may_embed(field.field)
+    return False
+
+
+def _has_changes(value) -> bool:
+    if isinstance(value, EmbeddedDocument):
+        return bool(value._get_changed_fields())
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return False
+    return any(_has_changes(item) for item in value)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType(
+            {key: _freeze(item) for key, item in value.items()}
+        )
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def field_tree(paths: Iterable[str]) -> Dict[str, Any]:
+    """
+    Nests dotted field paths, `True` marks the fields that are taken whole:
+    `['a', 'b.c', 'b.d']` is `{'a': True, 'b': {'c': True, 'd': True}}`
+    """
+    tree: Dict[str, Any] = {}
+    for path in sorted(paths, key=lambda path: path.count('.')):
+        node = tree
+        *parents, name = path.split('.')
+        for parent in parents:
+            node = node.setdefault(parent, {})
+            if node is True:
+                break
         else:
-            return_data[field_name] = mongo_to_python_type(
-                obj._fields[field_name], data
+            node[name] = True
+    return tree
+
+
+def _included(name: str, only: Optional[Dict], exclude: Dict) -> bool:
+    return (only is None or name in only) and exclude.get(name) is not True
+
+
+def _projected_converter(
+    field, converter: Callable, only: Optional[Dict], exclude: Dict
+) -> Callable:
+    # only embedded documents, alone or in lists, have fields to project
+    if isinstance(field, EmbeddedDocumentField):
+        project = _embedded_projection(only, exclude, _embedded_serializer)
+        return lambda data: {} if data is None else project(data)
+    if isinstance(field, ListField):
+        project = _embedded_projection(only, exclude, get_serializer)
+        return lambda items: [
+            (
+                project(item)
+                if isinstance(item, EmbeddedDocument)
+                else item_converter(type(item))(item)
             )
+            for item in items
+        ]
+    return converter
+
+
+def _embedded_projection(
+    only: Optional[Dict], exclude: Dict, serializer_of: Callable
+) -> Callable[[Any], dict]:
+    projections: Dict[type, Serializer] = {}
+
+    def project(data) -> dict:
+        # embedded documents may be of a subclass of the field's class
+        document = type(data)
+        try:
+            serializer = projections[document]
+        except KeyError:
+            serializer = projections[document] = serializer_of(
+                document
+            )._project(only, exclude)
+        return serializer(data)
+
+    return project
+
+
+def _embedded_serializer(document: type) -> Serializer:
+    # the serializer `embedded_document_to_dict` ends up using
+    if hasattr(document, '_serializer'):
+        return document._serializer()
+    return get_serializer(document)
+
+
+def _hidden_value(data) -> str:
+    return HIDDEN_VALUE
+
+
+def _default(field):
+    # the value the document would get for a missing field
+    if field.null or field.default is None:
+        return None
+    return field.default() if callable(field.default) else field.default
+
+
+_serializers: Dict[Tuple, Serializer] = {}
+
+
+def get_serializer(document: type, exclude: Iterable[str] = ()) -> Serializer:
+    key = (document, tuple(exclude))
+    try:
+        return _serializers[key]
+    except KeyError:
+        serializer = _serializers[key] = Serializer(document, exclude)
+        return serializer
 
-    return return_data
+
+# returns the output key of a field and the function that converts its values
+FieldConverter = Callable[[str, Any], Tuple[str, Callable[[Any], Any]]]
+
+_field_converters: Dict[type, FieldConverter] = {}
+_item_converters: Dict[type, Callable[[Any], Any]] = {}
+# converters resolved through the MRO, by class
+_resolved_fields: Dict[type, FieldConverter] = {}
+_resolved_items: Dict[type, Callable[[Any], Any]] = {}
+# changes with each registered field converter, serializers compiled with
+# another version are outdated
+_converters_version = 0
+
+
+def register_field_converter(
+    field_class: type, converter: FieldConverter
+) -> None:
+    """
+    Serializes the fields of `field_class` and its subclasses with
+    `converter(field_name, field)`, which returns the output key and the
+    function that converts the values of the field. Serializers compiled
+    before are compiled again the next time they're used
+    """
+    global _converters_version
+    _field_converters[field_class] = converter
+    _converters_version += 1
+    _resolved_fields.clear()
+    _serializers.clear()
+
+
+def register_item_converter(
+    item_type: type, converter: Callable[[Any], Any]
+) -> None:
+    """
+    Converts the list items of `item_type` and its subclasses with
+    `converter`. Items of other types are converted with `str`
+    """
+    _item_converters[item_type] = converter
+    _resolved_items.clear()
+
+
+def field_converter(field_name: str, field) -> Tuple[str, Callable]:
+    """
+    Returns the output key of the field and the function that converts its
+    values, following the same rules `mongo_to_dict` always had
+    """
+    field_class = type(field)
+    try:
+        converter = _resolved_fields[field_class]
+    except KeyError:
+        converter = _resolved_fields[field_class] = _resolve(
+            field_class, _field_converters, _scalar(str)
+        )
+    return converter(field_name, field)
+
+
+def _resolve(cls: type, converters: Dict[type, Any], default: Any) -> Any:
+    # the converter of the closest class in the MRO
+    for base in cls.__mro__:
+        if base in converters:
+            return converters[base]
+    return default
+
+
+def _scalar(convert: Callable[[Any], Any]) -> FieldConverter:
+    def converter(field_name: str, field) -> Tuple[str, Callable]:
+        return field_name, lambda data: None if data is None else convert(data)
+
+    return converter
+
+
+def _keyed(convert: Callable[[Any], Any], suffix: str = '') -> FieldConverter:
+    # the values of the field may be None, `convert` handles them
+    def converter(field_name: str, field) -> Tuple[str, Callable]:
+        return field_name + suffix, convert
+
+    return converter
+
+
+def _list_converter(field_name: str, field) -> Tuple[str, Callable]:
+    if isinstance(field.field, LazyReferenceField):
+        field_name = f'{field_name}_uris'
+    return field_name, list_field_to_dict
+
+
+def _complex_datetime_converter(
+    field_name: str, field
+) -> Tuple[str, Callable]:
+    return field_name, lambda data: (
+        None if data is None else field.to_python(data).isoformat()
+    )
+
+
+def _identity(data):
+    return data
+
+
+def _enum_value(data):
+    return data.value if data is not None else None
+
+
+def _lazy_reference_uri(data):
+    return f'/{data._DBRef__collection}/{data.id}' if data else None
+
+
+def _generic_lazy_reference_uri(data):
+    return (
+        f'/{data["_ref"]._DBRef__collection}/{data["_ref"].id}'
+        if data
+        else None
+    )
+
+
+def embedded_document_to_dict(data) -> dict:
+    if callable(getattr(data, 'to_dict', None)):
+        return data.to_dict()
+    return mongo_to_dict(data)
+
+
+def mongo_to_dict(obj, exclude_fields: list = None) -> dict:
+    """
+    from: https://gist.github.com/jason-w/4969476
+    """
+    if obj is None:
+        return {}
+    return get_serializer(type(obj), exclude_fields or ())(obj)
 
 
 def list_field_to_dict(list_field: list) -> list:
     return_data = []
-
+    # lists are usually of a single type, resolved once per run of items
+    item_type = convert = None
     for item in list_field:
-        if isinstance(item, EmbeddedDocument):
-            return_data.append(mongo_to_dict(item))
-        elif isinstance(item, Enum):
-            return_data.append(item.value)
-        elif isinstance(item, DBRef):  # pragma: no cover
-            return_data.append(f'/{item._DBRef__collection}/{item.id}')
-        else:
-            return_data.append(mongo_to_python_type(item, item))
-
+        if type(item) is not item_type:
+            item_type = type(item)
+            convert = item_converter(item_type)
+        return_data.append(convert(item))
     return return_data
 
 
+def item_converter(item_type: type) -> Callable[[Any], Any]:
+    try:
+        return _resolved_items[item_type]
+    except KeyError:
+        convert = _resolved_items[item_type] = _resolve(
+            item_type, _item_converters, str
+        )
+        return convert
+
+
+def python_type_converter(field) -> Callable[[Any], Any]:
+    return field_converter(field.name, field)[1]
+
+
+def _isoformat(data):
+    return data.isoformat()
+
+
+def _dbref_uri(data):  # pragma: no cover
+    return f'/{data._DBRef__collection}/{data.id}'
+
+
 def mongo_to_python_type(field, data):
-    rv = None
-    field_type = type(field)
     if data is None:
-        rv = None
-    elif field_type is DateTimeField:
-        rv = data.isoformat()
-    elif field_type is ComplexDateTimeField:
-        rv = field.to_python(data).isoformat()
-    elif rv is FloatField:  # pragma: no cover
-        rv = float(data)
-    elif field_type is IntField:
-        rv = int(data)
-    elif field_type is BooleanField:
-        rv = bool(data)
-    elif field_type is DecimalField:
-        rv = data
-    else:
-        rv = str(data)
-
-    return rv
+        return None
+    return python_type_converter(field)(data)
+
+
+register_field_converter(ListField, _list_converter)
+register_field_converter(
+    EmbeddedDocumentField, _keyed(embedded_document_to_dict)
+)
+register_field_converter(DictField, _keyed(_identity))
+register_field_converter(EnumField, _keyed(_enum_value))
+register_field_converter(
+    LazyReferenceField, _keyed(_lazy_reference_uri, '_uri')
+)
+register_field_converter(
+    GenericLazyReferenceField, _keyed(_generic_lazy_reference_uri, '_uri')
+)
+register_field_converter(DateTimeField, _scalar(_isoformat))
+register_field_converter(ComplexDateTimeField, _complex_datetime_converter)
+register_field_converter(IntField, _scalar(int))
+register_field_converter(BooleanField, _scalar(bool))
+register_field_converter(DecimalField, _scalar(_identity))
+
+register_item_converter(EmbeddedDocument, mongo_to_dict)
+register_item_converter(Enum, _enum_value)
+register_item_converter(DBRef, _dbref_uri)
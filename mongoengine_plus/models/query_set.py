@@ -0,0 +1,223 @@
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from mongoengine import EmbeddedDocumentField, ListField, Q
+from mongoengine.base import get_document
+from mongoengine.errors import LookUpError
+from mongoengine.queryset.field_list import QueryFieldList
+from pymongo.errors import BulkWriteError
+from pymongo.results import BulkWriteResult
+
+from ..types.encrypted_string.query_set import (
+    EncryptedQuerySet,
+    decrypt_documents,
+)
+from ..types.enum_field import EnumQuerySet, expand_enum_query
+from .base import BaseModel
+from .bulk import (
+    BULK_WRITE_CHUNK_SIZE,
+    BulkOperation,
+    empty_bulk_result,
+    merge_bulk_results,
+)
+from .encoder import JSON_CHUNK_SIZE, iter_json_array
+from .helpers import Serializer, get_serializer
+
+
+def document_serializer(
+    document: type,
+    only: Optional[Iterable[str]] = None,
+    exclude: Iterable[str] = (),
+) -> Serializer:
+    """
+    Returns the serializer `to_dict` uses for `document`, the one of
+    `mongo_to_dict` if it isn't a `BaseModel`, projected to `only` and
+    `exclude`
+    """
+    if issubclass(document, BaseModel):
+        serializer = document._serializer()
+    else:
+        serializer = get_serializer(document)
+    if only is not None or exclude:
+        serializer = serializer.project(only, exclude)
+    return serializer
+
+
+class BaseQuerySet(EncryptedQuerySet, EnumQuerySet):
+    """
+    QuerySet that can serialize its results straight from the raw
+    documents, without creating the document instances, and write many
+    operations in a single `bulk_write`
+    """
+
+    def to_dicts(
+        self, only: Optional[Iterable[str]] = None, exclude: Iterable[str] = ()
+    ) -> Iterator[Dict]:
+        """
+        Yields every document of the queryset as the dict `to_dict`
+        returns. Documents are read and serialized one cursor batch at a
+        time, so only a batch is kept in memory. `only` and `exclude` limit
+        both the fields MongoDB returns and the ones serialized
+        """
+        if self._none or self._empty:
+            return
+
+        queryset, spec = self._projected(only, exclude)
+        serializer = document_serializer(self._document, *spec)
+        while True:
+            raw_docs = queryset._next_raw_batch()
+            if not raw_docs:
+                return
+            decrypt_documents(
+                self._document, raw_docs, serializer.encrypted_fields
+            )
+            for raw_doc in raw_docs:
+                yield self._son_serializer(
+                    raw_doc, serializer, *spec
+                ).from_son(raw_doc)
+
+    def iter_json(
+        self,
+        only: Optional[Iterable[str]] = None,
+        exclude: Iterable[str] = (),
+        chunk_size: int = JSON_CHUNK_SIZE,
+    ) -> Iterator[bytes]:
+        """
+        Streams the dicts of `to_dicts` as a JSON array, in chunks of about
+        `chunk_size` bytes, e.g. for the body of an HTTP response
+        """
+        return iter_json_array(self.to_dicts(only, exclude), chunk_size)
+
+    def _projected(
+        self, only: Optional[Iterable[str]], exclude: Iterable[str]
+    ) -> Tuple['BaseQuerySet', Tuple]:
+        # the fields requested to MongoDB, also the ones of `.only()` and
+        # `.exclude()` calls, are the ones serialized. Names that aren't
+        # fields are ignored as `to_dict` ignores them
+        queryset = self.clone()
+        if only is not None:
+            queryset = queryset.only(*self._field_names(only))
+        exclude = self._field_names(exclude)
+        if exclude:
+            queryset = queryset.exclude(*exclude)
+
+        loaded = queryset._loaded_fields
+        names = tuple(
+            self._field_path(db_path)
+            for db_path in sorted(loaded.fields - loaded.slice.keys())
+        )
+        excluded_id: Tuple[str, ...] = ()
+        if loaded._id == QueryFieldList.EXCLUDE:
+            excluded_id = ('id',)
+        spec: Tuple[Optional[Tuple[str, ...]], Tuple[str, ...]]
+        if not names:
+            # `only=[]` serializes the id alone
+            spec = (None if only is None else (), excluded_id)
+        elif loaded.value == QueryFieldList.ONLY:
+            spec = (names, excluded_id)
+        else:
+            spec = (None, names + excluded_id)
+        return queryset, spec
+
+    def _field_path(self, db_path: str) -> str:
+        # the dotted field names of the dotted db fields of a projection
+        document = self._document
+        names = []
+        for part in db_path.split('.'):
+            if document is None:
+                names.append(part)
+                continue
+            name = document._reverse_db_field_map.get(part, part)
+            names.append(name)
+            field = document._fields.get(name)
+            while isinstance(field, ListField):
+                field = field.field
+            document = (
+                field.document_type
+                if isinstance(field, EmbeddedDocumentField)
+                else None
+            )
+        return '.'.join(names)
+
+    def _field_names(self, names: Iterable[str]) -> Tuple[str, ...]:
+        fields = []
+        for name in names:
+            try:
+                self._fields_to_dbfields([name])
+            except LookUpError:
+                continue
+            fields.append(name)
+        return tuple(fields)
+
+    def _son_serializer(
+        self,
+        raw_doc: Dict,
+        serializer: Serializer,
+        only: Optional[Iterable[str]] = None,
+        exclude: Iterable[str] = (),
+    ):
+        # documents of a subclass are serialized with their own fields
+        class_name = raw_doc.get('_cls')
+        if class_name is None or class_name == self._document._class_name:
+            return serializer
+        return document_serializer(get_document(class_name), only, exclude)
+
+    def bulk_write(
+        self, operations: Iterable[BulkOperation], ordered: bool = True
+    ) -> BulkWriteResult:
+        """
+        Sends the `operations` of `mongoengine_plus.models.bulk` to
+        MongoDB in bulk, `BULK_WRITE_CHUNK_SIZE` at a time. Filters are
+        combined with the filters of the queryset. Raises `BulkWriteError`
+        with the results of every chunk if any operation fails; in ordered
+        mode the chunks after the error aren't sent
+        """
+        totals = empty_bulk_result()
+        acknowledged = True
+        operations = iter(operations)
+        offset = 0
+        while chunk := list(islice(operations, BULK_WRITE_CHUNK_SIZE)):
+            requests = [operation.to_pymongo(self) for operation in chunk]
+            written = chunk
+            try:
+                result = self._collection.bulk_write(requests, ordered=ordered)
+            except BulkWriteError as error:
+                merge_bulk_results(totals, error.details, offset)
+                failed = {e['index'] for e in error.details['writeErrors']}
+                if ordered:
+                    # the operations after the error weren't sent
+                    written = chunk[: min(failed, default=len(chunk))]
+                else:
+                    written = [
+                        operation
+                        for index, operation in enumerate(chunk)
+                        if index not in failed
+                    ]
+            else:
+                if result.acknowledged:
+                    merge_bulk_results(totals, result.bulk_api_result, offset)
+                else:
+                    acknowledged = False
+
+            for operation in written:
+                operation.written()
+            if ordered and (
+                totals['writeErrors'] or totals['writeConcernErrors']
+            ):
+                raise BulkWriteError(totals)
+            offset += len(chunk)
+
+        if totals['writeErrors'] or totals['writeConcernErrors']:
+            raise BulkWriteError(totals)
+        return BulkWriteResult(totals, acknowledged)
+
+    def _bulk_query(self, q: Optional[Q]) -> Dict:
+        # the same query `_query` builds, with `q` added to the filters
+        query_obj = self._query_obj if q is None else self._query_obj & q
+        query = query_obj.to_query(self._document)
+        if self._cls_query:
+            if '_cls' in query:
+                query = {'$and': [self._cls_query, query]}
+            else:
+                query.update(self._cls_query)
+        return expand_enum_query(self._document, query)
@@ -1,4 +1,9 @@
-__all__ = ['EnumField', 'EncryptedStringField']
+__all__ = [
+    'EnumField',
+    'EnumQuerySet',
+    'EncryptedStringField',
+    'migrate_enum_field',
+]
 
 from .encrypted_string.fields import EncryptedStringField
-from .enum_field import EnumField
+from .enum_field import EnumField, EnumQuerySet, migrate_enum_field
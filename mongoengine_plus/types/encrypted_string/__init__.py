@@ -1,63 +1,44 @@
-__all__ = ['EncryptedStringField', 'cache_kms_data_key']
+__all__ = [
+    'EncryptedQuerySet',
+    'EncryptedStringField',
+    'KMSDataKeyCache',
+    'cache_kms_data_key',
+    'configure_crypto_executor',
+]
 
-import codecs
-
-import boto3
-from pymongo.encryption import _EncryptionIO
+from typing import Iterable, Optional, Union
 
+from .base import configure_crypto_executor, use_kms_data_key_cache
 from .fields import EncryptedStringField
+from .kms import KMSDataKeyCache
+from .query_set import EncryptedQuerySet
 
 
 def cache_kms_data_key(
     key_namespace: str,
-    key_name: str,
+    key_name: Union[str, Iterable[str]],
     aws_access_key_id: str,
     aws_secret_access_key: str,
     aws_region_name: str,
     kms_endpoint_url: str,
-) -> None:
+    ttl: Optional[float] = None,
+) -> KMSDataKeyCache:
     """
-    Retrieve the KMS Key used to encrypt and decrypt data and creates a cache
-    to optimize the usage of `EncryptedString`. You should execute this
-    function once before making any database write or read operations
+    Retrieve the KMS Keys used to encrypt and decrypt data and creates a cache
+    to optimize the usage of `EncryptedString`. `key_name` can be a list of
+    data keys that are decrypted in one pass. You should execute this
+    function once before making any database write or read operations.
+    Use `refresh()` on the returned cache after rotating the keys
     """
-    from .base import get_data_key
-
-    data_key = get_data_key(
+    key_names = [key_name] if isinstance(key_name, str) else key_name
+    cache = KMSDataKeyCache(
         key_namespace,
-        key_name,
-    )
-    kms = boto3.client(
-        'kms',
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        region_name=aws_region_name,
-        endpoint_url=kms_endpoint_url,
-    )
-    response = kms.decrypt(
-        CiphertextBlob=data_key['keyMaterial'],
-    )
-    decrypted_data_key = codecs.encode(
-        response['Plaintext'], 'base64'
-    ).decode()
-    decrypted_data_key = decrypted_data_key.replace('\n', '\\n')
-    content = (
-        '{'
-        '"EncryptionAlgorithm":"SYMMETRIC_DEFAULT",'
-        f'"Plaintext": "{decrypted_data_key}"'
-        '}'
+        aws_access_key_id,
+        aws_secret_access_key,
+        aws_region_name,
+        kms_endpoint_url,
+        ttl=ttl,
     )
-
-    content_length = len(content)
-
-    kms_response_template = (
-        f'HTTP/1.1 200 OK\r\n'
-        f'Content-Type: application/x-amz-json-1.1\r\n'
-        f'Content-Length: {content_length}\r\n'
-        f'Connection: close\r\n\r\n{content}'
-    ).encode()
-
-    def kms_request_with_cache(_, kms_context):
-        kms_context.feed(kms_response_template)
-
-    setattr(_EncryptionIO, 'kms_request', kms_request_with_cache)
+    cache.warm(key_names)
+    use_kms_data_key_cache(cache)
+    return cache
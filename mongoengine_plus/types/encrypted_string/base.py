@@ -1,16 +1,164 @@
-from functools import lru_cache
-from typing import Dict
+import asyncio
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 
-from bson import CodecOptions
+from bson import CodecOptions, decode, encode
 from bson.binary import STANDARD, UUID_SUBTYPE, Binary
 from mongoengine import get_connection
-from pymongo.encryption import ClientEncryption
+from mongoengine.connection import DEFAULT_CONNECTION_NAME
+from pymongo import MongoClient
+from pymongo.encryption import ClientEncryption, _wrap_encryption_errors
+from pymongocrypt.synchronous.state_machine import run_state_machine
 
+from .cache import LRUCache
 from .exc import NoDataKeyFound
 
+if TYPE_CHECKING:
+    from .kms import KMSDataKeyCache  # pragma: no cover
 
-def get_data_key(key_namespace: str, key_name: str) -> Dict:
+CODEC_OPTION = CodecOptions(uuid_representation=STANDARD)
+
+CRYPTO_MAX_WORKERS = 4
+DATA_KEY_CACHE_SIZE = 32
+
+data_key_cache = LRUCache(maxsize=DATA_KEY_CACHE_SIZE)
+
+kms_data_key_cache: Optional['KMSDataKeyCache'] = None
+
+_crypto_executor: Optional[ThreadPoolExecutor] = None
+_crypto_executor_lock = Lock()
+_client_encryptions: Dict[Tuple, Tuple[MongoClient, ClientEncryption]] = {}
+_client_encryptions_lock = Lock()
+
+
+def _freeze(kms_provider: Dict) -> Tuple:
+    return tuple(
+        (name, tuple(sorted(options.items())))
+        for name, options in sorted(kms_provider.items())
+    )
+
+
+def get_client_encryption(
+    kms_provider: Dict, key_namespace: str
+) -> ClientEncryption:
+    """
+    Returns the `ClientEncryption` for the current connection, `kms_provider`
+    and `key_namespace`. It's created once and reused by every encrypt and
+    decrypt operation so libmongocrypt can keep the data keys it already
+    fetched. A new one is created if the mongoengine connection changes
+    """
     connection = get_connection()
+    key = (key_namespace, _freeze(kms_provider))
+    cached = _client_encryptions.get(key)
+    if cached and cached[0] is connection:
+        return cached[1]
+
+    with _client_encryptions_lock:
+        cached = _client_encryptions.get(key)
+        if cached and cached[0] is connection:
+            return cached[1]
+        if cached:
+            cached[1].close()
+        client_encryption = ClientEncryption(
+            kms_provider, key_namespace, connection, CODEC_OPTION
+        )
+        io_callbacks = client_encryption._io_callbacks
+        io_callbacks.kms_request = partial(
+            _kms_request, io_callbacks.kms_request
+        )
+        _client_encryptions[key] = (connection, client_encryption)
+        return client_encryption
+
+
+def _kms_request(kms_request: Callable, kms_context: Any) -> None:
+    # answered locally when the data key is in the KMS data key cache
+    cache = kms_data_key_cache
+    if cache is None or not cache.feed(kms_context):
+        kms_request(kms_context)
+
+
+def use_kms_data_key_cache(cache: Optional['KMSDataKeyCache']) -> None:
+    global kms_data_key_cache
+    kms_data_key_cache = cache
+
+
+def close_client_encryptions() -> None:
+    """
+    Closes every `ClientEncryption` created by `get_client_encryption`.
+    It's called when the KMS configuration changes and at exit
+    """
+    with _client_encryptions_lock:
+        for _, client_encryption in _client_encryptions.values():
+            client_encryption.close()
+        _client_encryptions.clear()
+
+
+atexit.register(close_client_encryptions)
+
+
+def configure_crypto_executor(max_workers: int = CRYPTO_MAX_WORKERS) -> None:
+    """
+    Sets the size of the thread pool used to encrypt and decrypt from
+    asyncio code. It's separated from the pool used for Mongo I/O so a slow
+    key vault or KMS request can't take the threads queries need
+    """
+    global _crypto_executor
+    with _crypto_executor_lock:
+        previous = _crypto_executor
+        _crypto_executor = _new_crypto_executor(max_workers)
+    if previous:
+        previous.shutdown(wait=False)
+
+
+def _new_crypto_executor(max_workers: int) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix='mongoengine-plus-crypto'
+    )
+
+
+def _get_crypto_executor() -> ThreadPoolExecutor:
+    # created on first use, once even if several threads get here at once
+    global _crypto_executor
+    if _crypto_executor is None:
+        with _crypto_executor_lock:
+            if _crypto_executor is None:
+                _crypto_executor = _new_crypto_executor(CRYPTO_MAX_WORKERS)
+    return _crypto_executor
+
+
+async def run_in_crypto_executor(func: Callable, *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_crypto_executor(), partial(func, *args, **kwargs)
+    )
+
+
+def decrypt_many(
+    client_encryption: ClientEncryption, values: List[Binary]
+) -> List[Any]:
+    """
+    Decrypts all the `values` in a single libmongocrypt context instead of
+    creating one context per value like `ClientEncryption.decrypt` does
+    """
+    if not values:
+        return []
+    client_encryption._check_closed()
+    encrypter = client_encryption._encryption
+    doc = encode({str(i): value for i, value in enumerate(values)})
+    with _wrap_encryption_errors():
+        with encrypter.mongocrypt.decryption_context(doc) as ctx:
+            decrypted_doc = run_state_machine(ctx, encrypter.callback)
+    decrypted = decode(decrypted_doc, codec_options=CODEC_OPTION)
+    return [decrypted[str(i)] for i in range(len(values))]
+
+
+def get_data_key(
+    key_namespace: str, key_name: str, alias: str = DEFAULT_CONNECTION_NAME
+) -> Dict:
+    connection = get_connection(alias)
     key_db, key_coll = key_namespace.split(".", 1)
     vault = connection[key_db][key_coll]
 
@@ -21,18 +169,49 @@ def get_data_key(key_namespace: str, key_name: str) -> Dict:
     return data_key
 
 
-@lru_cache(maxsize=1)
-def get_data_key_binary(key_namespace: str, key_name: str) -> Binary:
+def _fetch_data_key_binary(
+    key_namespace: str, key_name: str, alias: str
+) -> Binary:
+    data_key = get_data_key(key_namespace, key_name, alias)
+    uuid_data_key = data_key['_id']
+    return Binary(uuid_data_key.bytes, UUID_SUBTYPE)
+
+
+def get_data_key_binary(
+    key_namespace: str, key_name: str, alias: str = DEFAULT_CONNECTION_NAME
+) -> Binary:
     """
-    Get the data_key from mongo, there is only one data_key so this
-    method always retrieve the same value, that's why we use the
-    `lru_cache`
+    Get the data_key `_id` from mongo. Data keys are cached by connection
+    alias, `key_namespace` and `key_name` in `data_key_cache`, so the key
+    vault is only queried the first time a key is used
     """
+    key = (alias, key_namespace, key_name)
+    return data_key_cache.get_or_set(
+        key, partial(_fetch_data_key_binary, key_namespace, key_name, alias)
+    )
 
-    # Buscamos el data key
-    data_key = get_data_key(key_namespace, key_name)
-    uuid_data_key = data_key['_id']
-    return Binary(uuid_data_key.bytes, UUID_SUBTYPE)
+
+def configure_data_key_cache(
+    maxsize: int = DATA_KEY_CACHE_SIZE, ttl: Optional[float] = None
+) -> None:
+    """
+    Changes the size of the data key cache and, if it's given, the seconds
+    its entries last. `ttl=0` stops expiring them
+    """
+    data_key_cache.resize(maxsize, ttl)
+
+
+def invalidate_data_key(
+    key_namespace: Optional[str] = None, key_name: Optional[str] = None
+) -> None:
+    """
+    Removes the cached data keys that match `key_namespace` and `key_name`,
+    all of them if none is given. Use it after rotating a data key
+    """
+    data_key_cache.invalidate(
+        lambda key: (key_namespace is None or key[1] == key_namespace)
+        and (key_name is None or key[2] == key_name)
+    )
 
 
 def create_data_key(
@@ -56,7 +235,7 @@ def create_data_key(
         kms_provider,
         key_namespace,
         connection,
-        CodecOptions(uuid_representation=STANDARD),
+        CODEC_OPTION,
     ) as client_encryption:
         client_encryption.create_data_key(
             'aws',
@@ -0,0 +1,120 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class _KeyLock:
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.waiters = 0
+
+
+class LRUCache:
+    """
+    Thread safe LRU cache with hit and miss counters, like
+    `functools.lru_cache` but its size can be changed at runtime, entries
+    can expire after `ttl` seconds and be invalidated one by one
+    """
+
+    def __init__(
+        self, maxsize: int = 128, ttl: Optional[float] = None
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, Tuple[Any, float]] = OrderedDict()
+        self._lock = Lock()
+        self._key_locks: Dict[Hashable, _KeyLock] = {}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value or stores the one returned by `factory`.
+        Concurrent misses of the same key call `factory` only once
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.get(key)
+            if key_lock is None:
+                key_lock = self._key_locks[key] = _KeyLock()
+            key_lock.waiters += 1
+        try:
+            with key_lock.lock:
+                with self._lock:
+                    value = self._get(key)
+                if value is None:
+                    value = factory()
+                    self.set(key, value)
+        finally:
+            # the lock is kept while other callers wait on it
+            with self._lock:
+                key_lock.waiters -= 1
+                if not key_lock.waiters:
+                    del self._key_locks[key]
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0.0
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def invalidate(self, predicate: Callable[[Any], bool]) -> None:
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def resize(self, maxsize: int, ttl: Optional[float] = None) -> None:
+        """
+        Changes the size and, if it's given, the `ttl` of the cache. Use
+        `ttl=0` to stop expiring entries
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def _get(self, key: Hashable) -> Optional[Any]:
+        try:
+            value, expires_at = self._data[key]
+        except KeyError:
+            return None
+        if expires_at and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def _evict(self) -> None:
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
@@ -4,3 +4,11 @@ class NoDataKeyFound(Exception):
     Por lo que no se puede encriptar o desencriptar
     algún dato
     """
+
+
+class KeyNameNotResolved(Exception):
+    """
+    El key_name del campo depende del documento y no hay un documento
+    del cual obtenerlo, por ejemplo al preparar el valor de una consulta.
+    Usa `EncryptedStringField.encrypt(value, key_name)`
+    """
@@ -1,20 +1,101 @@
-from typing import Any, ClassVar, Dict
+import weakref
+from typing import Any, Callable, ClassVar, Dict, Optional, Union
 
-from bson.binary import STANDARD
-from bson.codec_options import CodecOptions
-from mongoengine import get_connection
+from bson.binary import Binary
 from mongoengine.base import BaseField
 from pymongo.encryption import Algorithm, ClientEncryption
 
-from .base import get_data_key_binary
+from .base import CODEC_OPTION  # noqa: F401
+from .base import (
+    close_client_encryptions,
+    get_client_encryption,
+    get_data_key_binary,
+    run_in_crypto_executor,
+)
+from .cache import LRUCache
+from .exc import KeyNameNotResolved
 
-CODEC_OPTION = CodecOptions(uuid_representation=STANDARD)
+KeyName = Union[str, Callable[[Any], str]]
+
+
+def is_ciphertext(value: Any) -> bool:
+    return isinstance(value, Binary) and value.subtype == 6
+
+
+class DecryptedString(str):
+    """
+    Plaintext of a lazy `EncryptedStringField` that keeps the ciphertext
+    it was decrypted from, so it can be stored again without re-encrypting
+    while it stays in the same field of the same document
+    """
+
+    ciphertext: Binary
+    document: weakref.ReferenceType
+    field_name: str
+
+    def __reduce__(self):
+        # weak references can't be pickled, copies are plain strings that
+        # are encrypted again when they're stored
+        return str, (str(self),)
+
+
+def decrypted_string(
+    plaintext: str, ciphertext: Binary, document: Any, field_name: str
+) -> DecryptedString:
+    value = DecryptedString(plaintext)
+    value.ciphertext = ciphertext
+    value.document = weakref.ref(document)
+    value.field_name = field_name
+    return value
+
+
+class DocumentString(str):
+    """
+    Plaintext of an `EncryptedStringField` whose key name is picked per
+    document. It keeps a reference to the document to resolve the key
+    when the value is encrypted
+    """
+
+    document: weakref.ReferenceType
+
+    def __reduce__(self):
+        # copies get the reference again when they're set in a document
+        return str, (str(self),)
+
+
+def _copied(value: Any, instance: Any, field_name: str) -> bool:
+    if isinstance(value, DecryptedString):
+        return (
+            value.document() is not instance or value.field_name != field_name
+        )
+    if isinstance(value, DocumentString):
+        return value.document() is not instance
+    return False
+
+
+def _root_document(document: Any) -> Any:
+    # the keys of embedded documents are picked from the document they're in
+    while getattr(document, '_instance', None) is not None:
+        document = document._instance
+    return document
 
 
 class EncryptedStringField(BaseField):
     """
     Represents an encrypted string. Supports two types of
     encryption algorithms: Deterministic and Random.
+
+    With `lazy=True` the document keeps the ciphertext read from MongoDB
+    and decrypts it the first time the attribute is read.
+
+    Query values of deterministic fields are encrypted once and kept in
+    `query_cache`, since the same plaintext always has the same ciphertext.
+
+    By default every field uses the `key_namespace` and `key_name` set by
+    `configure_aws_kms`. A field can use its own data key with `key_name`,
+    which can also be a callable that receives the document, the top-level
+    one for fields of embedded documents, and returns the key name, e.g.
+    one data key per tenant.
     """
 
     kms_provider: ClassVar[Dict[str, Any]]
@@ -23,13 +104,46 @@ class EncryptedStringField(BaseField):
     _aws_access_key_id: ClassVar[str]
     _aws_secret_access_key: ClassVar[str]
     aws_region_name: ClassVar[str]
+    query_cache: ClassVar[LRUCache] = LRUCache(maxsize=1024)
 
     algorithm: Algorithm
+    lazy: bool
 
-    def __init__(self, algorithm: Algorithm, **kwargs) -> None:
+    def __init__(
+        self,
+        algorithm: Algorithm,
+        lazy: bool = False,
+        key_name: Optional[KeyName] = None,
+        key_namespace: Optional[str] = None,
+        **kwargs,
+    ) -> None:
         self.algorithm = algorithm
+        self.lazy = lazy
+        self._key_name = key_name
+        self._key_namespace = key_namespace
         super().__init__(**kwargs)
 
+    def __get__(self, instance, owner):
+        value = super().__get__(instance, owner)
+        if instance is None or not self.lazy or not is_ciphertext(value):
+            return value
+
+        plaintext = decrypted_string(
+            self.client_encryption.decrypt(value), value, instance, self.name
+        )
+        instance._data[self.name] = plaintext
+        return plaintext
+
+    def __set__(self, instance, value):
+        # values copied from another field or document are encrypted again,
+        # with the key of this one
+        if _copied(value, instance, self.name):
+            value = str(value)
+        if callable(self._key_name) and type(value) is str:
+            value = DocumentString(value)
+            value.document = weakref.ref(instance)
+        super().__set__(instance, value)
+
     @classmethod
     def configure_aws_kms(
         cls,
@@ -50,26 +164,90 @@ class EncryptedStringField(BaseField):
                 secretAccessKey=aws_secret_access_key,
             )
         )
+        close_client_encryptions()
+        cls.query_cache.clear()
+
+    @classmethod
+    def configure_query_cache(cls, maxsize: int) -> None:
+        cls.query_cache.resize(maxsize)
+
+    @property
+    def data_key_namespace(self) -> str:
+        return self._key_namespace or self.key_namespace
+
+    @property
+    def has_document_key(self) -> bool:
+        return callable(self._key_name)
+
+    @property
+    def client_encryption(self) -> ClientEncryption:
+        return get_client_encryption(
+            self.kms_provider, self.data_key_namespace
+        )
+
+    def resolve_key_name(self, document: Any = None) -> str:
+        if callable(self._key_name):
+            if document is None:
+                raise KeyNameNotResolved
+            return self._key_name(document)
+        return self._key_name or self.key_name
+
+    def encrypt(self, value: Any, key_name: Optional[str] = None) -> Binary:
+        """
+        Encrypts `value` with the data key `key_name`, or the field's key.
+        Use it to query fields whose key name is picked per document:
+        `User.objects(ssn=User.ssn.encrypt('123', key_name='tenant'))`
+        """
+        data_key = get_data_key_binary(
+            self.data_key_namespace, key_name or self.resolve_key_name()
+        )
+        return self.client_encryption.encrypt(value, self.algorithm, data_key)
 
     def to_python(self, value: Any) -> Any:
         if value is None or isinstance(value, str):
             return value
+        if self.lazy:
+            return value
 
-        connection = get_connection()
-
-        with ClientEncryption(
-            self.kms_provider, self.key_namespace, connection, CODEC_OPTION
-        ) as client_encryption:
-            return client_encryption.decrypt(value)
+        return self.client_encryption.decrypt(value)
 
     def to_mongo(self, value: Any) -> Any:
-        connection = get_connection()
-        data_key = get_data_key_binary(self.key_namespace, self.key_name)
+        if is_ciphertext(value):
+            return value
+        if isinstance(value, DecryptedString):
+            return value.ciphertext
 
-        with ClientEncryption(
-            self.kms_provider, self.key_namespace, connection, CODEC_OPTION
-        ) as client_encryption:
-            return client_encryption.encrypt(value, self.algorithm, data_key)
+        document = None
+        if isinstance(value, DocumentString):
+            document = _root_document(value.document())
+        return self.encrypt(value, self.resolve_key_name(document))
+
+    async def async_encrypt(self, value: Any) -> Any:
+        return await run_in_crypto_executor(self.to_mongo, value)
+
+    async def async_decrypt(self, value: Any) -> Any:
+        if not is_ciphertext(value):
+            return value
+        return await run_in_crypto_executor(
+            self.client_encryption.decrypt, value
+        )
 
     def prepare_query_value(self, op, value):
-        return super().prepare_query_value(op, self.to_mongo(value))
+        if (
+            self.algorithm
+            != Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic
+            or not isinstance(value, str)
+            or self.has_document_key
+        ):
+            return super().prepare_query_value(op, self.to_mongo(value))
+
+        # keyed by data key so a rotated key doesn't reuse old ciphertexts
+        data_key = get_data_key_binary(
+            self.data_key_namespace, self.resolve_key_name()
+        )
+        key = (data_key, value)
+        ciphertext = self.query_cache.get(key)
+        if ciphertext is None:
+            ciphertext = self.to_mongo(value)
+            self.query_cache.set(key, ciphertext)
+        return super().prepare_query_value(op, ciphertext)
@@ -0,0 +1,131 @@
+import base64
+import codecs
+import json
+from typing import Any, Iterable, List, Optional
+
+import boto3
+from mongoengine import get_connection
+
+from .cache import LRUCache
+from .exc import NoDataKeyFound
+
+KMS_DATA_KEY_CACHE_SIZE = 1024
+
+
+def kms_decrypt_response(plaintext: bytes) -> bytes:
+    """
+    Builds the HTTP response of AWS KMS `Decrypt` for `plaintext`, the way
+    libmongocrypt expects to read it
+    """
+    decrypted_data_key = codecs.encode(plaintext, 'base64').decode()
+    decrypted_data_key = decrypted_data_key.replace('\n', '\\n')
+    content = (
+        '{'
+        '"EncryptionAlgorithm":"SYMMETRIC_DEFAULT",'
+        f'"Plaintext": "{decrypted_data_key}"'
+        '}'
+    )
+
+    content_length = len(content)
+
+    return (
+        f'HTTP/1.1 200 OK\r\n'
+        f'Content-Type: application/x-amz-json-1.1\r\n'
+        f'Content-Length: {content_length}\r\n'
+        f'Connection: close\r\n\r\n{content}'
+    ).encode()
+
+
+def decrypt_request_ciphertext(message: bytes) -> Optional[bytes]:
+    """
+    Returns the `CiphertextBlob` of a KMS `Decrypt` request, `None` for
+    any other request
+    """
+    _, _, body = message.partition(b'\r\n\r\n')
+    try:
+        ciphertext = json.loads(body)['CiphertextBlob']
+    except (ValueError, KeyError, TypeError):
+        return None
+    return base64.b64decode(ciphertext)
+
+
+class KMSDataKeyCache:
+    """
+    Local cache of the data keys decrypted by AWS KMS. libmongocrypt asks
+    KMS to decrypt the key material of a data key every time it loads the
+    key; with this cache those requests are answered locally. Each key
+    material is mapped to its plaintext, entries expire after `ttl`
+    seconds and missing keys are decrypted with boto3 and cached.
+    """
+
+    def __init__(
+        self,
+        key_namespace: str,
+        aws_access_key_id: str,
+        aws_secret_access_key: str,
+        aws_region_name: str,
+        kms_endpoint_url: str,
+        ttl: Optional[float] = None,
+        maxsize: int = KMS_DATA_KEY_CACHE_SIZE,
+    ) -> None:
+        self.key_namespace = key_namespace
+        self.key_names: List[str] = []
+        self.plaintexts = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._kms = boto3.client(
+            'kms',
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            region_name=aws_region_name,
+            endpoint_url=kms_endpoint_url,
+        )
+
+    def warm(self, key_names: Iterable[str]) -> None:
+        """
+        Reads the data keys named `key_names` from the key vault in a
+        single query and caches their decrypted key material. Raises
+        `NoDataKeyFound` if any of them isn't in the key vault
+        """
+        key_names = list(key_names)
+        db_name, collection_name = self.key_namespace.split('.', 1)
+        vault = get_connection()[db_name][collection_name]
+        data_keys = list(vault.find({'keyAltNames': {'$in': key_names}}))
+        found = {name for key in data_keys for name in key['keyAltNames']}
+        missing = [name for name in key_names if name not in found]
+        if missing:
+            raise NoDataKeyFound(*missing)
+
+        self.key_names.extend(
+            name for name in key_names if name not in self.key_names
+        )
+        for data_key in data_keys:
+            ciphertext = bytes(data_key['keyMaterial'])
+            self.plaintexts.set(ciphertext, self._decrypt(ciphertext))
+
+    def refresh(self) -> None:
+        """
+        Decrypts again the data keys passed to `warm`, e.g. after
+        rotating them
+        """
+        self.plaintexts.clear()
+        self.warm(self.key_names)
+
+    def clear(self) -> None:
+        self.plaintexts.clear()
+
+    def feed(self, kms_context: Any) -> bool:
+        """
+        Answers a libmongocrypt KMS request. Returns `False` if it isn't a
+        `Decrypt` request so it's sent to KMS
+        """
+        ciphertext = decrypt_request_ciphertext(kms_context.message)
+        if ciphertext is None:
+            return False
+        plaintext = self.plaintexts.get_or_set(
+            ciphertext, lambda: self._decrypt(ciphertext)
+        )
+        kms_context.feed(kms_decrypt_response(plaintext))
+        return True
+
+    def _decrypt(self, ciphertext: bytes) -> bytes:
+        response = self._kms.decrypt(CiphertextBlob=ciphertext)
+        return response['Plaintext']
@@ -0,0 +1,132 @@
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Type
+
+from mongoengine import Document, QuerySet
+
+from ...cursor import next_batch
+from .base import decrypt_many, run_in_crypto_executor
+from .fields import (
+    DecryptedString,
+    EncryptedStringField,
+    decrypted_string,
+    is_ciphertext,
+)
+
+
+def encrypted_fields(document: Type[Document]) -> List[EncryptedStringField]:
+    return [
+        field
+        for field in document._fields.values()
+        if isinstance(field, EncryptedStringField) and not field.lazy
+    ]
+
+
+def decrypt_documents(
+    document: Type[Document],
+    raw_docs: Iterable[Dict],
+    fields: Optional[List[EncryptedStringField]] = None,
+) -> None:
+    """
+    Decrypts in one pass every `EncryptedStringField` value of `raw_docs`
+    and writes the plaintext back into them, so `to_python` doesn't have
+    to decrypt one value at a time. `fields` defaults to the non-lazy
+    encrypted fields of `document`
+    """
+    if fields is None:
+        fields = encrypted_fields(document)
+    if not fields:
+        return
+
+    targets: Dict[str, List] = {}
+    for raw_doc in raw_docs:
+        for field in fields:
+            value = raw_doc.get(field.db_field)
+            if is_ciphertext(value):
+                targets.setdefault(field.data_key_namespace, []).append(
+                    (raw_doc, field, value)
+                )
+
+    # values of the same key vault are decrypted together
+    for field_targets in targets.values():
+        client_encryption = field_targets[0][1].client_encryption
+        values = decrypt_many(
+            client_encryption, [value for _, _, value in field_targets]
+        )
+        for (raw_doc, field, _), value in zip(field_targets, values):
+            raw_doc[field.db_field] = value
+
+
+async def async_decrypt_documents(
+    document: Type[Document],
+    raw_docs: List[Dict],
+    fields: Optional[List[EncryptedStringField]] = None,
+) -> None:
+    if fields is None:
+        fields = encrypted_fields(document)
+    if fields:
+        await run_in_crypto_executor(
+            decrypt_documents, document, raw_docs, fields
+        )
+
+
+async def async_encrypt_document(document: Document) -> None:
+    """
+    Encrypts the plaintext values of the `EncryptedStringField`s of
+    `document` in one call to the crypto executor. They're kept with their
+    ciphertexts, so saving the document writes them without encrypting
+    """
+    targets = [
+        (field_name, field, value)
+        for field_name, field in document._fields.items()
+        if isinstance(field, EncryptedStringField)
+        and isinstance(value := document._data.get(field_name), str)
+        and not isinstance(value, DecryptedString)
+    ]
+    if not targets:
+        return
+
+    ciphertexts = await run_in_crypto_executor(
+        lambda: [field.to_mongo(value) for _, field, value in targets]
+    )
+    for (field_name, _, value), ciphertext in zip(targets, ciphertexts):
+        # unless it changed while it was encrypted
+        if document._data.get(field_name) is value:
+            document._data[field_name] = decrypted_string(
+                value, ciphertext, document, field_name
+            )
+
+
+class EncryptedQuerySet(QuerySet):
+    """
+    QuerySet that decrypts the `EncryptedStringField` values of a whole
+    cursor batch at once before building the documents
+    """
+
+    _raw_batch: Optional[Deque[Dict]] = None
+
+    def __next__(self):
+        if self._none or self._empty or self._as_pymongo:
+            return super().__next__()
+
+        if not self._raw_batch:
+            raw_docs = self._next_raw_batch()
+            if not raw_docs:
+                raise StopIteration
+            self._raw_batch = deque(raw_docs)
+            decrypt_documents(self._document, self._raw_batch)
+        return self._from_raw(self._raw_batch.popleft())
+
+    def rewind(self):
+        self._raw_batch = None
+        super().rewind()
+
+    def _next_raw_batch(self) -> List[Dict]:
+        return next_batch(self._cursor)
+
+    def _from_raw(self, raw_doc: Dict) -> Any:
+        doc = self._document._from_son(
+            raw_doc, _auto_dereference=self._auto_dereference
+        )
+        if self._scalar:
+            return self._get_scalar(doc)
+        return doc
@@ -1,7 +1,9 @@
 from enum import Enum
-from typing import Any, Type, Union
+from typing import Any, Dict, List, Mapping, Optional, Type, Union
 
+from mongoengine import Document, ListField, QuerySet
 from mongoengine.base import BaseField
+from mongoengine.queryset import transform
 
 
 class EnumField(BaseField):
@@ -11,31 +13,275 @@ class EnumField(BaseField):
     A class to register Enum type (from the package enum34) into mongo
     :param choices: must be of :class:`enum.Enum`: type
         and will be used as possible choices
+    :param codes: short codes, e.g. small integers, to store instead of
+        the values of the members. Both forms are read, so the stored
+        values can be migrated with `migrate_enum_field`
+    :param store_codes: set it to False to read the codes but keep storing
+        the values, while not every reader knows the codes
+
+    While there are codes, the queries of `EnumQuerySet` match both forms,
+    so documents not migrated yet are found too
     """
 
-    def __init__(self, enum: Type[Enum], *args, **kwargs):
+    def __init__(
+        self,
+        enum: Type[Enum],
+        *args,
+        codes: Optional[Mapping[Any, Union[int, str]]] = None,
+        store_codes: bool = True,
+        **kwargs,
+    ):
         self.enum = enum
+        self.codes = dict(codes or {})
+        # stored form -> member, computed once to convert and validate
+        # with a lookup
+        self._members: Dict[Any, Enum] = {}
+        for member in enum:
+            self._members[member] = member
+            self._members[member.value] = member
+        for member, code in self.codes.items():
+            if self._members.get(code, member) is not member:
+                raise ValueError(f'Code {code!r} of {member} is already used')
+            self._members[code] = member
+        # member -> stored form
+        self._stored: Dict[Enum, Any] = {
+            member: (
+                self.codes.get(member, member.value)
+                if store_codes
+                else member.value
+            )
+            for member in enum
+        }
         kwargs['choices'] = [choice for choice in enum]
         super(EnumField, self).__init__(*args, **kwargs)
 
-    def __get_value(self, enum: Enum) -> Union[str, Any]:
-        return enum.value if hasattr(enum, 'value') else enum
+    def _member(self, value: Any) -> Optional[Enum]:
+        try:
+            return self._members.get(value)
+        except TypeError:  # unhashable values
+            return None
 
-    def to_python(self, value: Enum) -> Enum:  # pragma: no cover
-        return self.enum(super(EnumField, self).to_python(value))
+    def to_python(self, value: Any) -> Enum:
+        member = self._member(value)
+        if member is None:
+            # unknown values, Enum._missing_ may still handle them
+            return self.enum(value)
+        return member
 
-    def to_mongo(self, value: Enum) -> str:
-        return self.__get_value(value)
+    def to_mongo(self, value: Enum) -> Any:
+        member = self._member(value)
+        if member is None:
+            return value.value if hasattr(value, 'value') else value
+        return self._stored[member]
 
-    def prepare_query_value(self, op, value: Enum) -> str:
-        return super(EnumField, self).prepare_query_value(  # pragma: no cover
-            op, self.__get_value(value)
+    def prepare_query_value(self, op, value: Enum) -> Any:
+        return super(EnumField, self).prepare_query_value(
+            op, self.to_mongo(value)
         )
 
-    def validate(self, value: Enum) -> Enum:
-        return super(EnumField, self).validate(self.__get_value(value))
+    def query_forms(self, value: Any) -> List[Any]:
+        """
+        The forms `value` can be stored in: the one the field stores and,
+        if the member has a code, the other one
+        """
+        member = self._member(value)
+        forms = [self.to_mongo(value)]
+        if member is not None and member in self.codes:
+            for form in (self.codes[member], member.value):
+                if form not in forms:
+                    forms.append(form)
+        return forms
+
+    def _validate_choices(self, value: Any) -> None:
+        # a lookup instead of the scan of `choices`, with members, values
+        # and codes
+        if self._member(value) is None:
+            self.error(f'Value must be one of {self.choices}')
+
 
-    def _validate(self, value: Enum, **kwargs) -> Enum:
-        return super(EnumField, self)._validate(
-            self.enum(self.__get_value(value)), **kwargs
+def coded_fields(document: Type[Document]) -> Dict[str, EnumField]:
+    """
+    The `EnumField`s with codes of `document`, or of its lists, by their
+    `db_field`
+    """
+    fields = {}
+    for field in document._fields.values():
+        enum_field = field.field if isinstance(field, ListField) else field
+        if isinstance(enum_field, EnumField) and enum_field.codes:
+            fields[field.db_field] = enum_field
+    return fields
+
+
+def _all_forms(field: EnumField, values: Any) -> List[Any]:
+    forms: List[Any] = []
+    for value in values:
+        forms.extend(
+            form for form in field.query_forms(value) if form not in forms
         )
+    return forms
+
+
+def _expand_condition(field: EnumField, condition: Any) -> Any:
+    if isinstance(condition, list):
+        # whole lists are matched in the stored form
+        return condition
+    if not isinstance(condition, dict):
+        forms = field.query_forms(condition)
+        return {'$in': forms} if len(forms) > 1 else condition
+    expanded: Dict[str, Any] = {}
+    for operator, value in condition.items():
+        if operator == '$ne':
+            operator, value = '$nin', [value]
+        if operator in ('$in', '$nin'):
+            value = _all_forms(field, expanded.get(operator, []) + value)
+        elif operator == '$not':
+            value = _expand_condition(field, value)
+        expanded[operator] = value
+    return expanded
+
+
+def expand_enum_query(document: Type[Document], query: Dict) -> Dict:
+    """
+    Rewrites the conditions on the `EnumField`s with codes of `query` to
+    match both forms: equality and `in` become `$in`, `ne` and `nin`
+    become `$nin` of every form
+    """
+    fields = coded_fields(document)
+    if not fields:
+        return query
+    return _expand_query(fields, query)
+
+
+def _expand_query(fields: Dict[str, EnumField], query: Dict) -> Dict:
+    expanded = {}
+    for key, value in query.items():
+        if key in ('$and', '$or', '$nor'):
+            value = [_expand_query(fields, item) for item in value]
+        elif key in fields:
+            value = _expand_condition(fields[key], value)
+        expanded[key] = value
+    return expanded
+
+
+def expand_enum_update(document: Type[Document], update: Dict) -> Dict:
+    """
+    Rewrites the `$pull` and `$pullAll` of the lists of `EnumField`s with
+    codes of `update` to remove both forms
+    """
+    fields = coded_fields(document)
+    pulls = {**update.get('$pull', {}), **update.get('$pullAll', {})}
+    if not fields.keys() & pulls.keys():
+        return update
+    expanded = {
+        operator: value
+        for operator, value in update.items()
+        if operator not in ('$pull', '$pullAll')
+    }
+    pull = dict(update.get('$pull', {}))
+    pull_all = {}
+    for key, values in update.get('$pullAll', {}).items():
+        if key in fields:
+            # the conditions of $pull can match every form
+            pull[key] = {'$in': values}
+        else:
+            pull_all[key] = values
+    for key, value in pull.items():
+        if key in fields:
+            pull[key] = _expand_condition(fields[key], value)
+    if pull:
+        expanded['$pull'] = pull
+    if pull_all:
+        expanded['$pullAll'] = pull_all
+    return expanded
+
+
+class EnumQuerySet(QuerySet):
+    """
+    QuerySet whose filters and updates match both forms of the
+    `EnumField`s with codes, see `expand_enum_query` and
+    `expand_enum_update`
+    """
+
+    @property
+    def _query(self) -> Dict:
+        if self._mongo_query is None:  # type: ignore[has-type]
+            self._mongo_query = expand_enum_query(
+                self._document, super(EnumQuerySet, self)._query
+            )
+        return self._mongo_query
+
+    def update(
+        self,
+        upsert=False,
+        multi=True,
+        write_concern=None,
+        read_concern=None,
+        full_result=False,
+        array_filters=None,
+        **update,
+    ):
+        return super(EnumQuerySet, self).update(
+            upsert=upsert,
+            multi=multi,
+            write_concern=write_concern,
+            read_concern=read_concern,
+            full_result=full_result,
+            array_filters=array_filters,
+            **self._expand_update(update),
+        )
+
+    def modify(
+        self,
+        upsert=False,
+        full_response=False,
+        remove=False,
+        new=False,
+        array_filters=None,
+        **update,
+    ):
+        return super(EnumQuerySet, self).modify(
+            upsert=upsert,
+            full_response=full_response,
+            remove=remove,
+            new=new,
+            array_filters=array_filters,
+            **self._expand_update(update),
+        )
+
+    def _expand_update(self, update: Dict) -> Dict:
+        # pipelines and raw updates are sent as they are
+        if not update or '__raw__' in update:
+            return update
+        compiled = transform.update(self._document, **update)
+        return dict(__raw__=expand_enum_update(self._document, compiled))
+
+
+def migrate_enum_field(document: Type[Document], field_name: str) -> int:
+    """
+    Rewrites the values of the `EnumField`, or list of them, `field_name`
+    to the form the field stores now: codes instead of values or, with
+    `store_codes=False`, back to values. Returns the number of documents
+    updated, run it again if any was written meanwhile
+    """
+    field = document._fields[field_name]
+    enum_field = field.field if isinstance(field, ListField) else field
+    collection = document._get_collection()
+    updated = 0
+    for member, code in enum_field.codes.items():
+        stored = enum_field.to_mongo(member)
+        previous = member.value if stored == code else code
+        if previous == stored:
+            continue
+        if isinstance(field, ListField):
+            result = collection.update_many(
+                {field.db_field: previous},
+                {'$set': {f'{field.db_field}.$[item]': stored}},
+                array_filters=[{'item': previous}],
+            )
+        else:
+            result = collection.update_many(
+                {field.db_field: previous},
+                {'$set': {field.db_field: stored}},
+            )
+        updated += result.modified_count
+    return updated
@@ -32,6 +32,10 @@ setup(
         'boto3>=1.34.106,<2.0.0',
         'blinker>=1.9.0,<2.0.0',
     ],
+    extras_require=dict(
+        motor=['motor>=2.5.1,<3.0.0; python_version < "3.11"'],
+        orjson=['orjson>=3.9.0,<4.0.0'],
+    ),
     classifiers=[
         'Programming Language :: Python :: 3.9',
         'Programming Language :: Python :: 3.10',
@@ -1,9 +1,24 @@
+import asyncio
+import json
+import time
+
 import pytest
-from mongoengine import Q
+from mongoengine import IntField, ListField, Q
+from pymongo.cursor import Cursor
 
+from mongoengine_plus.aio import AsyncDocument, utils
+from mongoengine_plus.aio.async_query_set import AsyncQuerySet
+from mongoengine_plus.aio.utils import ExecutorCursor
+from mongoengine_plus.cursor import next_batch
+from mongoengine_plus.models.bulk import DeleteOne, Insert, UpdateMany
 from tests.aio.cities import City
 
 
+class Purchase(AsyncDocument):
+    amount = IntField()
+    items = ListField(IntField())
+
+
 @pytest.mark.asyncio
 async def test_count(cities):
     count = await City.objects.async_count()
@@ -27,6 +42,133 @@ async def test_to_list(cities):
     assert len(filtered) == 3
 
 
+@pytest.mark.asyncio
+async def test_async_to_dicts(cities):
+    queryset = City.objects.order_by('id')
+    dicts = [city async for city in queryset.async_to_dicts()]
+    assert dicts == [
+        dict(id=city.id, name=city.name, state=city.state)
+        for city in sorted(cities, key=lambda city: city.id)
+    ]
+    dicts = [city async for city in queryset.async_to_dicts(only=['name'])]
+    assert dicts == [
+        dict(id=city.id, name=city.name)
+        for city in sorted(cities, key=lambda city: city.id)
+    ]
+    body = b''.join([chunk async for chunk in queryset.async_iter_json()])
+    assert json.loads(body) == [
+        dict(id=city.id, name=city.name, state=city.state)
+        for city in sorted(cities, key=lambda city: city.id)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_async_iter(cities):
+    queryset = City.objects.order_by('id').batch_size(2)
+    cities_from_db = [city async for city in queryset]
+    assert [city.id for city in cities_from_db] == sorted(
+        city.id for city in cities
+    )
+    chiapas = [city async for city in City.objects(state='Chiapas')]
+    assert len(chiapas) == 2
+    raw = [city async for city in City.objects.as_pymongo()]
+    assert len(raw) == len(cities) and isinstance(raw[0], dict)
+    assert [city async for city in City.objects.none()] == []
+
+
+@pytest.mark.asyncio
+async def test_async_bulk_write(cities):
+    result = await City.objects.async_bulk_write(
+        [
+            Insert(City(name='Mérida', state='Yucatán')),
+            UpdateMany(Q(state='Chiapas'), set__state='CHIS'),
+            DeleteOne(Q(name='Monterrey')),
+        ],
+        ordered=False,
+    )
+    assert result.inserted_count == 1
+    assert result.modified_count == 2
+    assert result.deleted_count == 1
+    assert await City.objects(state='CHIS').async_count() == 2
+    await City.objects(name='Mérida').async_delete()
+
+
+@pytest.mark.asyncio
+async def test_async_in_bulk(cities):
+    ids = [city.id for city in cities[:3]]
+    documents = await City.objects.async_in_bulk(ids + ['C-unknown'])
+    assert set(documents) == set(ids)
+    assert documents[ids[0]].name == cities[0].name
+
+    chiapas = await City.objects(state='Chiapas').async_in_bulk(ids)
+    assert list(chiapas) == []
+    raw = await City.objects.as_pymongo().async_in_bulk(ids)
+    assert raw[ids[0]]['name'] == cities[0].name
+
+
+@pytest.mark.asyncio
+async def test_async_aggregate(cities):
+    pipeline = [
+        {'$group': {'_id': '$state', 'total': {'$sum': 1}}},
+        {'$sort': {'_id': 1}},
+    ]
+    results = City.objects.async_aggregate(
+        pipeline, allowDiskUse=True, batchSize=2
+    )
+    totals = {result['_id']: result['total'] async for result in results}
+    assert totals == {
+        'CDMX': 1,
+        'Chiapas': 2,
+        'Nuevo León': 1,
+        'Tabasco': 1,
+    }
+    chiapas = [
+        result
+        async for result in City.objects(state='Chiapas').async_aggregate(
+            [{'$project': {'name': 1}}]
+        )
+    ]
+    assert len(chiapas) == 2
+
+
+@pytest.mark.asyncio
+async def test_async_sum_and_average():
+    for amount, items in ((10, [1]), (20, [1, 2]), (60, [3])):
+        await Purchase(amount=amount, items=items).async_save()
+    assert await Purchase.objects.async_sum('amount') == 90
+    assert await Purchase.objects.async_average('amount') == 30
+    assert await Purchase.objects(amount__gt=10).async_sum('amount') == 80
+    assert await Purchase.objects(amount=0).async_sum('amount') == 0
+    # the items of lists are counted one by one
+    assert await Purchase.objects.async_sum('items') == 7
+    assert await Purchase.objects.async_average('items') == 1.75
+    assert await Purchase.objects.async_item_frequencies('items') == {
+        1: 2,
+        2: 1,
+        3: 1,
+    }
+    await Purchase.objects.async_delete()
+
+
+@pytest.mark.asyncio
+async def test_async_distinct_and_frequencies(cities):
+    states = await City.objects.async_distinct('state')
+    assert sorted(states) == ['CDMX', 'Chiapas', 'Nuevo León', 'Tabasco']
+    frequencies = await City.objects.async_item_frequencies('state')
+    assert frequencies == {
+        'CDMX': 1,
+        'Chiapas': 2,
+        'Nuevo León': 1,
+        'Tabasco': 1,
+    }
+    frequencies = await City.objects(state='Chiapas').async_item_frequencies(
+        'state', normalize=True
+    )
+    assert frequencies == {'Chiapas': 1.0}
+    explain = await City.objects(state='Chiapas').async_explain()
+    assert 'queryPlanner' in explain
+
+
 @pytest.mark.asyncio
 async def test_first(cities):
     first_city = await City.objects(state='Tabasco').async_first()
@@ -108,3 +250,68 @@ async def test_async_modify(cities):
     # Verify the document was removed
     db_city = await City.objects(name='Cancún').async_first()
     assert db_city is None
+
+
+@pytest.mark.asyncio
+async def test_timeouts(cities, monkeypatch):
+    max_times = []
+    set_max_time = Cursor.max_time_ms
+
+    def max_time_ms(cursor, max_time):
+        if max_time is not None:
+            max_times.append(max_time)
+        return set_max_time(cursor, max_time)
+
+    monkeypatch.setattr(Cursor, 'max_time_ms', max_time_ms)
+    queryset = City.objects(id__in=[city.id for city in cities])
+    assert len(await queryset.async_to_list(timeout=1.5)) == len(cities)
+    assert await queryset.async_count(timeout=1.5) == len(cities)
+    assert await City.objects.async_count(timeout=1.5) == City.objects.count()
+    assert max_times == [1500]
+    await cities[0].async_reload(timeout=2)
+    assert max_times[-1] == 2000
+
+    aggregated = []
+    aggregate = AsyncQuerySet.aggregate
+
+    def timed_aggregate(queryset, pipeline, **kwargs):
+        aggregated.append(kwargs['maxTimeMS'])
+        return aggregate(queryset, pipeline, **kwargs)
+
+    monkeypatch.setattr(AsyncQuerySet, 'aggregate', timed_aggregate)
+    await Purchase.objects.async_sum('amount', timeout=1)
+    await Purchase.objects.async_average('amount', timeout=1)
+    await City.objects.async_item_frequencies('state', timeout=1)
+    assert aggregated == [1000, 1000, 1000]
+
+    opened = []
+
+    def slow_batch(cursor):
+        opened.append(cursor)
+        time.sleep(0.2)
+        return next_batch(cursor)
+
+    monkeypatch.setattr(utils, 'next_batch', slow_batch)
+    with pytest.raises(asyncio.TimeoutError):
+        await City.objects.async_to_list(timeout=0.05)
+    # closed once the batch being fetched is done
+    await asyncio.sleep(0.3)
+    assert not opened[0].alive
+
+
+@pytest.mark.asyncio
+async def test_stopped_iteration_closes_cursor(cities, monkeypatch):
+    closed = []
+    close = ExecutorCursor.close
+
+    def record_close(executor_cursor):
+        closed.append(executor_cursor.cursor)
+        close(executor_cursor)
+
+    monkeypatch.setattr(ExecutorCursor, 'close', record_close)
+    iterator = City.objects.batch_size(1).__aiter__()
+    assert isinstance(await iterator.__anext__(), City)
+    await iterator.aclose()
+    await asyncio.sleep(0.1)
+    assert len(closed) == 1
+    assert not closed[0].alive
@@ -1,8 +1,18 @@
+import asyncio
+
 import pytest
 from mongoengine import StringField
 
 from mongoengine_plus.aio.async_document import AsyncDocument
-from mongoengine_plus.aio.async_signals import post_save, pre_save
+from mongoengine_plus.aio.async_signals import (
+    log_receiver_error,
+    post_bulk_insert,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+    receiver_options,
+)
 from mongoengine_plus.models.event_handlers import handler
 
 
@@ -41,3 +51,104 @@ async def test_async_signal_handler_on_asyncdocument():
     assert post_calls[-1][1] == "yes"
     assert len(pre_calls) == 2
     assert len(post_calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_receivers_and_timeouts():
+    calls = []
+
+    first_started = asyncio.Event()
+    second_started = asyncio.Event()
+
+    # each one waits for the other to start, in order they'd never finish
+    @receiver_options(concurrent=True)
+    async def first(sender, document, **kwargs):
+        first_started.set()
+        await second_started.wait()
+        calls.append('first')
+
+    @receiver_options(concurrent=True, timeout=1)
+    async def second(sender, document, **kwargs):
+        second_started.set()
+        await first_started.wait()
+        calls.append('second')
+
+    async def in_order(sender, document, **kwargs):
+        calls.append('in_order')
+
+    class Card(AsyncDocument):
+        number = StringField()
+
+    for fn in (first, second, in_order):
+        post_save.connect(fn, sender=Card)
+    await asyncio.wait_for(Card(number='1234').async_save(), 5)
+    assert sorted(calls) == ['first', 'in_order', 'second']
+
+    @receiver_options(timeout=0.01)
+    async def slow(sender, document, **kwargs):
+        await asyncio.sleep(1)
+
+    pre_save.connect(slow, sender=Card)
+    with pytest.raises(asyncio.TimeoutError):
+        await Card(number='5678').async_save()
+    assert Card.objects(number='5678').count() == 0
+    Card.drop_collection()
+
+
+@pytest.mark.asyncio
+async def test_background_receivers():
+    calls = []
+    errors = []
+    post_save.on_error = lambda signal, receiver, error: errors.append(error)
+
+    release = asyncio.Event()
+
+    @receiver_options(background=True)
+    async def webhook(sender, document, **kwargs):
+        await release.wait()
+        calls.append(document.number)
+
+    @receiver_options(background=True)
+    async def failing(sender, document, **kwargs):
+        raise ValueError(document.number)
+
+    class Payment(AsyncDocument):
+        number = StringField()
+
+    post_save.connect(webhook, sender=Payment)
+    post_save.connect(failing, sender=Payment)
+    # the save doesn't wait for the webhook, which waits for the release
+    await Payment(number='1').async_save()
+    assert calls == []
+
+    release.set()
+    await post_save.join()
+    assert calls == ['1']
+    assert [str(error) for error in errors] == ['1']
+    post_save.on_error = log_receiver_error
+    Payment.drop_collection()
+
+
+@pytest.mark.asyncio
+async def test_delete_and_bulk_insert_signals():
+    calls = []
+
+    async def record(sender, **kwargs):
+        calls.append(kwargs)
+
+    class Device(AsyncDocument):
+        name = StringField()
+
+    for signal in (pre_delete, post_delete, post_bulk_insert):
+        signal.connect(record, sender=Device)
+
+    devices = await Device.objects.async_insert(
+        [Device(name='a'), Device(name='b')]
+    )
+    assert calls[0]['documents'] == devices
+    assert calls[0]['loaded'] is True
+
+    await devices[0].async_delete()
+    assert calls[1] == calls[2] == dict(document=devices[0])
+    assert await Device.objects.async_count() == 1
+    Device.drop_collection()
@@ -0,0 +1,116 @@
+import asyncio
+from typing import Generator
+from unittest.mock import MagicMock
+
+import pytest
+from mongoengine import Q
+from mongoengine.connection import _connection_settings
+
+from mongoengine_plus.aio import async_query_set, backend
+from mongoengine_plus.aio.backend import get_motor_client, use_motor
+
+from .cities import City
+
+requires_motor = pytest.mark.skipif(
+    backend.AsyncIOMotorClient is None, reason='motor is not available'
+)
+
+
+@pytest.fixture
+def motor(monkeypatch) -> Generator[None, None, None]:
+    def no_threads(*args, **kwargs):
+        raise AssertionError('query ran in the executor')
+
+    use_motor()
+    monkeypatch.setattr(async_query_set, 'create_awaitable', no_threads)
+    yield
+    use_motor(False)
+
+
+@requires_motor
+@pytest.mark.asyncio
+async def test_motor_queries(cities, motor):
+    assert await City.objects.async_count() == len(cities)
+    assert await City.objects(state='Chiapas').async_count() == 2
+    assert await City.objects.limit(2).async_count(True) == 2
+
+    filtered = await City.objects.filter(
+        Q(state='Chiapas') | Q(state='Tabasco')
+    ).async_to_list()
+    assert len(filtered) == 3
+
+    ordered = await City.objects.order_by('-name').skip(1).async_to_list()
+    assert [city.name for city in ordered] == sorted(
+        [city.name for city in cities], reverse=True
+    )[1:]
+
+    city = await City.objects.order_by('name').async_first()
+    assert city.name == 'Ciudad de México'
+    assert await City.objects(name='Cancún').async_first() is None
+
+    city = await City.objects.only('name').async_get(state='CDMX')
+    assert city.name == 'Ciudad de México'
+    assert city.state is None
+    with pytest.raises(City.DoesNotExist):
+        await City.objects.async_get(state='Yucatán')
+    with pytest.raises(City.MultipleObjectsReturned):
+        await City.objects.async_get(state='Chiapas')
+
+
+@requires_motor
+@pytest.mark.asyncio
+async def test_motor_client_is_reused(cities, motor):
+    client = get_motor_client('default')
+    await City.objects.async_count()
+    assert get_motor_client('default') is client
+
+
+def test_motor_client_settings(monkeypatch):
+    motor_client = MagicMock(side_effect=lambda **kwargs: MagicMock())
+    monkeypatch.setattr(backend, 'AsyncIOMotorClient', motor_client)
+    monkeypatch.setitem(
+        _connection_settings,
+        'auth',
+        dict(
+            name='db',
+            host='mongodb://localhost:27017',
+            username='user',
+            password='secret',
+            authentication_source='admin',
+            authentication_mechanism='SCRAM-SHA-256',
+            read_preference=None,
+        ),
+    )
+
+    async def client():
+        return get_motor_client('auth')
+
+    try:
+        first = asyncio.run(client())
+        _, kwargs = motor_client.call_args
+        kwargs.pop('io_loop')
+        assert kwargs == dict(
+            host='mongodb://localhost:27017',
+            username='user',
+            password='secret',
+            authSource='admin',
+            authMechanism='SCRAM-SHA-256',
+        )
+        # a new loop gets a new client and the previous one is closed
+        second = asyncio.run(client())
+        assert second is not first
+        first.close.assert_called_once()
+        second.close.assert_not_called()
+    finally:
+        backend.close_motor_clients('auth')
+
+
+def test_use_motor_without_motor(monkeypatch):
+    monkeypatch.setattr(backend, 'AsyncIOMotorClient', None)
+    monkeypatch.setattr(backend, 'MOTOR_SUPPORTED', False)
+    with pytest.raises(ImportError, match='Python < 3.11'):
+        use_motor()
+    monkeypatch.setattr(backend, 'MOTOR_SUPPORTED', True)
+    with pytest.raises(ImportError, match='motor is required'):
+        use_motor()
+    assert not backend.motor_enabled()
@@ -0,0 +1,105 @@
+from collections import deque
+from copy import deepcopy
+
+import pytest
+from pymongo.collection import Collection
+from pymongo.command_cursor import CommandCursor
+
+from mongoengine_plus.aio.change_stream import ResumeTokenStore
+
+from .cities import City
+
+
+def command_cursor(batch):
+    # the cursor pymongo creates for a batch of a change stream, already
+    # exhausted in the server
+    return CommandCursor(
+        City._get_collection(), dict(id=0, firstBatch=batch), None
+    )
+
+
+class ChangeStream:
+    # replays the batches like a pymongo change stream, with pymongo's
+    # command cursors
+    def __init__(self, batches, **options):
+        self.batches = deque(batches)
+        self.options = options
+        self.resume_token = None
+        self.closed = False
+        self._cursor = command_cursor([])
+
+    def try_next(self):
+        if not self._cursor.alive:
+            if not self.batches:
+                return None
+            self._cursor = command_cursor(self.batches.popleft())
+        change = next(self._cursor)
+        self.resume_token = change['_id']
+        return change
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def streams(monkeypatch):
+    streams = []
+    batches = [
+        [
+            dict(
+                _id={'_data': '1'},
+                operationType='insert',
+                documentKey={'_id': 'C1'},
+                fullDocument={'_id': 'C1', 'name': 'Mérida'},
+            ),
+            dict(
+                _id={'_data': '2'},
+                operationType='update',
+                documentKey={'_id': 'C1'},
+                updateDescription={'updatedFields': {'state': 'YUC'}},
+            ),
+        ],
+        [
+            dict(
+                _id={'_data': '3'},
+                operationType='delete',
+                documentKey={'_id': 'C1'},
+            )
+        ],
+    ]
+
+    def watch(collection, **options):
+        stream = ChangeStream(deepcopy(batches), **options)
+        streams.append(stream)
+        return stream
+
+    monkeypatch.setattr(Collection, 'watch', watch)
+    return streams
+
+
+@pytest.mark.asyncio
+async def test_async_watch(streams):
+    store = ResumeTokenStore()
+    changes = City.async_watch(max_await_time_ms=50, token_store=store)
+
+    insert = await changes.__anext__()
+    assert insert.operation_type == 'insert'
+    assert isinstance(insert.document, City)
+    assert insert.document.name == 'Mérida'
+    update = await changes.__anext__()
+    assert update.document is None
+    assert update.update_description['updatedFields'] == {'state': 'YUC'}
+    assert store.tokens == {}
+
+    delete = await changes.__anext__()
+    assert delete.document_key == {'_id': 'C1'}
+    # saved after the first batch was processed
+    assert store.tokens == {'city': {'_data': '2'}}
+    await changes.aclose()
+    assert streams[0].closed
+    assert streams[0].options['max_await_time_ms'] == 50
+
+    changes = City.async_watch(token_store=store)
+    await changes.__anext__()
+    assert streams[1].options['resume_after'] == {'_data': '2'}
+    await changes.aclose()
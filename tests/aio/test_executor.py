@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from mongoengine_plus.aio import configure_executor
+from mongoengine_plus.aio.executor import (
+    READ,
+    WRITE,
+    executor_stats,
+    get_executor,
+)
+from mongoengine_plus.aio.utils import create_awaitable
+
+from .cities import City
+
+
+@pytest.fixture
+def executor():
+    configure_executor(max_workers=2, max_queue=1, write_workers=1)
+    yield
+    configure_executor()
+
+
+@pytest.mark.asyncio
+async def test_executor_back_pressure(executor):
+    pending = []
+
+    def slow_call():
+        pending.append(get_executor().stats().queued)
+        time.sleep(0.05)
+        return threading.current_thread().name
+
+    names = await asyncio.gather(
+        *[create_awaitable(slow_call) for _ in range(6)]
+    )
+    assert all(name.startswith('mongoengine-plus-aio') for name in names)
+    # 2 running and at most 1 waiting for a thread
+    assert max(pending) <= 1
+
+    stats = executor_stats()
+    assert stats.max_workers == 2
+    assert stats.submitted == stats.completed == 6
+    assert stats.queued == stats.running == 0
+    assert stats.max_wait >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_cancelled_calls_keep_their_slot():
+    configure_executor(max_workers=1, max_queue=0)
+    release = threading.Event()
+    started = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    def blocked_call():
+        loop.call_soon_threadsafe(started.set)
+        release.wait()
+
+    task = asyncio.ensure_future(create_awaitable(blocked_call))
+    try:
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # the thread still runs the cancelled call, the next one waits
+        following = asyncio.ensure_future(create_awaitable(lambda: 'done'))
+        await asyncio.sleep(0)
+        assert executor_stats().submitted == 1
+    finally:
+        release.set()
+    assert await following == 'done'
+    assert executor_stats().completed == 2
+    configure_executor()
+
+
+@pytest.mark.asyncio
+async def test_executor_for_writes(executor, cities):
+    assert get_executor(WRITE) is not get_executor(READ)
+    await City(name='Mérida', state='Yucatán').async_save()
+    assert executor_stats(WRITE).completed == 1
+    assert await City.objects(state='Yucatán').async_count() == 1
+    assert executor_stats(READ).completed == 1
+    await City.objects(state='Yucatán').async_delete()
+
+
+def test_executor_default_size():
+    configure_executor()
+    assert get_executor(READ) is get_executor(WRITE)
+    assert executor_stats().max_workers == 100
+    assert executor_stats().max_queue == 100
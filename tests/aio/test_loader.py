@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from mongoengine_plus.aio.async_query_set import AsyncQuerySet
+
+from .cities import City
+
+
+@pytest.fixture
+def in_bulk_calls(monkeypatch):
+    calls = []
+    async_in_bulk = AsyncQuerySet.async_in_bulk
+
+    async def counted(self, object_ids):
+        calls.append(list(object_ids))
+        return await async_in_bulk(self, object_ids)
+
+    monkeypatch.setattr(AsyncQuerySet, 'async_in_bulk', counted)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_loader_batches_loads(cities, in_bulk_calls):
+    loader = City.objects.loader()
+    first, second, missing, again = await asyncio.gather(
+        loader.load(cities[0].id),
+        loader.load(cities[1].id),
+        loader.load('C-unknown'),
+        loader.load(cities[0].id),
+    )
+    assert first.name == cities[0].name
+    assert second.name == cities[1].name
+    assert missing is None
+    assert again is first
+    assert len(in_bulk_calls) == 1
+
+    # cached ids aren't fetched again
+    documents = await loader.load_many([city.id for city in cities])
+    assert [city.name for city in documents] == [city.name for city in cities]
+    assert in_bulk_calls[1] == [city.id for city in cities[2:]]
+
+    loader.clear(cities[0].id)
+    await loader.load(cities[0].id)
+    assert len(in_bulk_calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_loader_max_batch_size(cities, in_bulk_calls):
+    loader = City.objects.loader(max_batch_size=2)
+    await loader.load_many([city.id for city in cities])
+    assert [len(ids) for ids in in_bulk_calls] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_loader_errors_are_not_cached(cities, monkeypatch):
+    async def fail(self, object_ids):
+        raise ConnectionError
+
+    loader = City.objects.loader()
+    monkeypatch.setattr(AsyncQuerySet, 'async_in_bulk', fail)
+    with pytest.raises(ConnectionError):
+        await loader.load(cities[0].id)
+    monkeypatch.undo()
+    city = await loader.load(cities[0].id)
+    assert city.name == cities[0].name
+
+
+@pytest.mark.asyncio
+async def test_loader_cancelled_awaiters(cities, monkeypatch):
+    fetching = asyncio.Event()
+    async_in_bulk = AsyncQuerySet.async_in_bulk
+
+    async def slow(self, object_ids):
+        fetching.set()
+        await asyncio.sleep(0.01)
+        return await async_in_bulk(self, object_ids)
+
+    monkeypatch.setattr(AsyncQuerySet, 'async_in_bulk', slow)
+    loader = City.objects.loader()
+    cancelled = asyncio.ensure_future(loader.load(cities[0].id))
+    waiting = asyncio.ensure_future(loader.load(cities[0].id))
+    await fetching.wait()
+    cancelled.cancel()
+    # the other awaiter of the same id still gets the document
+    city = await waiting
+    assert city.name == cities[0].name
+    assert cancelled.cancelled()
+
+    # a cancelled fetch, started or not, isn't cached
+    for started in (True, False):
+        task = asyncio.ensure_future(loader.load(cities[1].id))
+        await asyncio.sleep(0.001 if started else 0)
+        for fetch in loader._tasks:
+            fetch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    monkeypatch.undo()
+    city = await loader.load(cities[1].id)
+    assert city.name == cities[1].name
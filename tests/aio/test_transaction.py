@@ -0,0 +1,123 @@
+import pytest
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+
+from mongoengine_plus.aio import async_run_in_transaction, async_transaction
+from mongoengine_plus.aio.transaction import current_session
+
+from .cities import City
+
+
+class FakeSession:
+    """
+    The test database is a standalone server, which doesn't support
+    transactions
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.in_transaction = False
+        self.operations = []
+        self.commits = 0
+        self.aborted = False
+        self.ended = False
+
+    def start_transaction(self, **options):
+        self.in_transaction = True
+
+    def commit_transaction(self):
+        self.commits += 1
+        self.in_transaction = False
+
+    def abort_transaction(self):
+        self.aborted = True
+        self.in_transaction = False
+
+    def end_session(self):
+        self.ended = True
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    sessions = []
+
+    def start_session(client, **kwargs):
+        sessions.append(FakeSession(client))
+        return sessions[-1]
+
+    def record(name):
+        method = getattr(Collection, name)
+
+        def call(collection, *args, session=None, **kwargs):
+            if session:
+                session.operations.append(name)
+            return method(collection, *args, **kwargs)
+
+        return call
+
+    monkeypatch.setattr(MongoClient, 'start_session', start_session)
+    for name in ('insert_one', 'update_many', 'count_documents'):
+        monkeypatch.setattr(Collection, name, record(name))
+    yield sessions
+    City.objects.delete()
+
+
+@pytest.mark.asyncio
+async def test_transaction_commit(sessions):
+    async with async_transaction() as session:
+        assert current_session() is session
+        await City(name='Colima', state='Colima').async_save()
+        await City.objects(state='Colima').async_update(set__name='Manzanillo')
+        async with async_transaction() as nested:
+            assert nested is session
+            assert await City.objects(state='Colima').async_count() == 1
+    assert current_session() is None
+
+    assert len(sessions) == 1
+    assert session.operations == [
+        'insert_one',
+        'update_many',
+        'count_documents',
+    ]
+    assert session.commits == 1
+    assert session.ended
+
+    await City(name='Tecomán', state='Colima').async_save()
+    assert len(session.operations) == 3
+
+
+@pytest.mark.asyncio
+async def test_transaction_abort(sessions):
+    with pytest.raises(ValueError):
+        async with async_transaction() as session:
+            await City(name='Toluca', state='México').async_save()
+            raise ValueError
+    assert session.aborted
+    assert not session.commits
+    assert session.ended
+
+
+@pytest.mark.asyncio
+async def test_run_in_transaction_retries(sessions):
+    async def move_city():
+        await City(name='Tijuana', state='Baja California').async_save()
+        if len(sessions) == 1:
+            raise OperationFailure(
+                'WriteConflict',
+                112,
+                {'errorLabels': ['TransientTransactionError']},
+            )
+        return len(sessions)
+
+    assert await async_run_in_transaction(move_city) == 2
+    assert sessions[0].aborted
+    assert sessions[1].commits == 1
+    assert [session.operations for session in sessions] == [['insert_one']] * 2
+
+    async def fail():
+        raise OperationFailure('Unauthorized', 13)
+
+    with pytest.raises(OperationFailure):
+        await async_run_in_transaction(fail)
+    assert len(sessions) == 3
@@ -1,11 +1,20 @@
+import json
+from types import MappingProxyType
+
+import pytest
 from mongoengine import (
     Document,
     EmbeddedDocument,
     EmbeddedDocumentField,
+    EmbeddedDocumentListField,
+    LazyReferenceField,
+    ListField,
     StringField,
 )
 
 from mongoengine_plus.models import BaseModel
+from mongoengine_plus.models.encoder import encode_json
+from mongoengine_plus.models.helpers import PROJECTIONS_CACHE_SIZE
 
 
 class File(EmbeddedDocument):
@@ -59,3 +68,150 @@ def test_hide_field():
         },
     }
     assert model_dict == expected
+    # hidden fields keep their position
+    assert list(model_dict) == ['id', 'secret_field', 'address', 'document']
+    assert list(model_dict['address']) == ['street', 'secret_code']
+
+
+def test_to_dict_serializer_is_compiled_once():
+    model = TestModel(id='12345', secret_field='secret')
+    assert model.to_dict() == model.to_dict()
+    serializer = TestModel.__dict__['_compiled_serializer']
+    assert TestModel(id='6789').to_dict() == dict(
+        id='6789', address={}, document={}, secret_field='********'
+    )
+    assert TestModel.__dict__['_compiled_serializer'] is serializer
+    assert [key for _, key, _, _ in serializer.fields] == [
+        'secret_field',
+        'address',
+        'document',
+    ]
+
+
+class Branch(BaseModel, Document):
+    id = StringField(primary_key=True)
+    name = StringField()
+    secret_field = StringField()
+    address = EmbeddedDocumentField(Address)
+    files = EmbeddedDocumentListField(File)
+    owner = LazyReferenceField(TestModel)
+
+    _hidden = ['secret_field']
+
+
+def test_to_dict_projection():
+    branch = Branch(
+        id='B1',
+        name='Centro',
+        secret_field='secret',
+        address=Address(street='Reforma 222', secret_code='1234'),
+        files=[
+            File(url='https://example.com/a', file_type='pdf'),
+            File(url='https://example.com/b', file_type='png'),
+        ],
+    )
+    assert branch.to_dict(only=['name', 'secret_field']) == dict(
+        id='B1', name='Centro', secret_field='********'
+    )
+    assert branch.to_dict(only=['address.street', 'files.url']) == dict(
+        id='B1',
+        address=dict(street='Reforma 222'),
+        files=[
+            dict(url='https://example.com/a'),
+            dict(url='https://example.com/b'),
+        ],
+    )
+    assert branch.to_dict(only=['address', 'address.street']) == dict(
+        id='B1',
+        address=dict(street='Reforma 222', secret_code='********'),
+    )
+    assert branch.to_dict(
+        exclude=['id', 'address.secret_code', 'files.file_type', 'owner']
+    ) == dict(
+        name='Centro',
+        secret_field='********',
+        address=dict(street='Reforma 222'),
+        files=[
+            dict(url='https://example.com/a'),
+            dict(url='https://example.com/b'),
+        ],
+    )
+    assert branch.to_dict(only=['name', 'missing']) == dict(
+        id='B1', name='Centro'
+    )
+    serializer = Branch._serializer()
+    assert serializer.project(['name']) is serializer.project(['name'])
+    # the order of the names doesn't matter
+    assert serializer.project(['name', 'address']) is serializer.project(
+        ['address', 'name', 'name']
+    )
+    # and the projections kept are bounded
+    for i in range(PROJECTIONS_CACHE_SIZE + 1):
+        serializer.project(['name', f'missing_{i}'])
+    assert len(serializer._projections._data) == PROJECTIONS_CACHE_SIZE
+
+
+class Settings(BaseModel, Document):
+    name = StringField()
+    secret_field = StringField()
+    address = EmbeddedDocumentField(Address)
+    files = EmbeddedDocumentListField(File)
+    tags = ListField(StringField())
+
+    _hidden = ['secret_field']
+
+
+def test_cached_dict():
+    settings = Settings(
+        name='main',
+        secret_field='secret',
+        address=Address(street='Reforma 222'),
+        files=[File(url='https://example.com/a')],
+        tags=['a'],
+    )
+    settings.save()
+    cached = settings.cached_dict()
+    assert isinstance(cached, MappingProxyType)
+    assert cached is settings.cached_dict()
+    assert json.loads(encode_json(cached)) == settings.to_dict()
+    with pytest.raises(TypeError):
+        cached['name'] = 'other'  # type: ignore[index]
+    with pytest.raises(TypeError):
+        cached['address']['street'] = 'other'
+    assert cached['files'] == (
+        dict(url='https://example.com/a', file_type=None),
+    )
+
+    address = cached['address']
+    settings.name = 'other'
+    settings.tags.append('b')
+    assert settings.cached_dict()['name'] == 'other'
+    assert cached['tags'] == ('a', 'b')
+    # only the fields that changed are converted again
+    assert cached['address'] is address
+
+    settings.address.street = 'Insurgentes 1'
+    settings.files[0].file_type = 'pdf'
+    assert cached['address'] is address
+    settings.cached_dict()
+    assert cached['address']['street'] == 'Insurgentes 1'
+    assert cached['files'][0]['file_type'] == 'pdf'
+
+    # changes of embedded documents saved before the dict is read again
+    settings.address.street = 'Juárez 3'
+    settings.save()
+    assert settings.cached_dict()['address']['street'] == 'Juárez 3'
+    assert json.loads(encode_json(cached)) == settings.to_dict()
+
+    Settings.objects(id=settings.id).update(name='reloaded')
+    settings.reload()
+    assert settings.cached_dict()['name'] == 'reloaded'
+    assert settings.cached_dict() is not cached
+
+
+def test_cached_dict_of_embedded_document_first():
+    # BaseModel after EmbeddedDocument can't see the changes
+    address = Address(street='Reforma 222')
+    assert address.cached_dict()['street'] == 'Reforma 222'
+    address.street = 'Insurgentes 1'
+    assert address.cached_dict()['street'] == 'Insurgentes 1'
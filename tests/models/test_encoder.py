@@ -0,0 +1,119 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+
+import pytest
+from bson import ObjectId
+from mongoengine import DecimalField, Document, IntField, StringField
+
+from mongoengine_plus.models import BaseModel, BaseQuerySet, encoder
+from mongoengine_plus.models.encoder import encode_json, iter_json_array
+
+
+class Status(Enum):
+    active = 'active'
+
+
+class Account(BaseModel, Document):
+    number = IntField()
+    name = StringField()
+    balance = DecimalField(precision=2)
+    secret = StringField()
+
+    _hidden = ['secret']
+    meta = dict(queryset_class=BaseQuerySet)
+
+
+fast_encoders = pytest.mark.parametrize(
+    'fast_encoder',
+    [
+        pytest.param(
+            True,
+            marks=pytest.mark.skipif(
+                not encoder.FAST_ENCODER, reason='orjson>=3.9 is required'
+            ),
+        ),
+        False,
+    ],
+)
+
+
+@fast_encoders
+def test_encode_json(monkeypatch, fast_encoder):
+    monkeypatch.setattr(encoder, 'FAST_ENCODER', fast_encoder)
+    object_id = ObjectId()
+    data = dict(
+        name='Pérez "Juan"',
+        balance=Decimal('10.50'),
+        items=[1, 2.5, True, None, (3, 4)],
+        extra={'created_at': datetime(2024, 1, 2, 3, 4, 5)},
+        status=Status.active,
+        ref=object_id,
+    )
+    encoded = encode_json(data)
+    # the json module writes decimals as floats
+    balance = b'"balance":10.50' if fast_encoder else b'"balance":10.5'
+    assert balance in encoded
+    assert '"Pérez'.encode() in encoded
+    assert json.loads(encoded) == dict(
+        name='Pérez "Juan"',
+        balance=10.5,
+        items=[1, 2.5, True, None, [3, 4]],
+        extra={'created_at': '2024-01-02T03:04:05'},
+        status='active',
+        ref=str(object_id),
+    )
+
+
+@fast_encoders
+def test_to_json_bytes_without_the_dict(monkeypatch, fast_encoder):
+    monkeypatch.setattr(encoder, 'FAST_ENCODER', fast_encoder)
+    account = Account(number=1, name='Pérez', balance='1.5', secret='s')
+    account.save()
+    for only, exclude in [
+        (None, ()),
+        (['name', 'secret'], ()),
+        (None, ['id', 'number']),
+        ([], ['id']),
+    ]:
+        assert account.to_json_bytes(only, exclude) == encode_json(
+            account.to_dict(only, exclude)
+        )
+    assert account.to_json_bytes([], ['id']) == b'{}'
+    Account.drop_collection()
+
+
+def test_iter_json_array():
+    dicts = [dict(number=number) for number in range(100)]
+    chunks = list(iter_json_array(dicts, chunk_size=64))
+    assert len(chunks) > 1
+    assert json.loads(b''.join(chunks)) == dicts
+    assert list(iter_json_array([])) == [b'[]']
+
+
+def test_to_json_bytes_and_iter_json():
+    accounts = [
+        Account(number=i, name=f'Account {i}', balance='1.5', secret='s')
+        for i in range(3)
+    ]
+    for account in accounts:
+        account.save()
+
+    account = Account.objects.get(number=0)
+    assert json.loads(account.to_json_bytes()) == json.loads(
+        json.dumps(account.to_dict(), default=float)
+    )
+    balance = b'"balance":1.50' if encoder.FAST_ENCODER else b'"balance":1.5'
+    assert balance in account.to_json_bytes()
+    assert json.loads(account.to_json_bytes(only=['name'])) == dict(
+        id=str(account.id), name='Account 0'
+    )
+
+    queryset = Account.objects.order_by('number')
+    body = b''.join(queryset.iter_json(exclude=['secret']))
+    assert json.loads(body) == [
+        json.loads(account.to_json_bytes(exclude=['secret']))
+        for account in queryset
+    ]
+    Account.drop_collection()
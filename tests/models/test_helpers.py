@@ -1,6 +1,9 @@
+import timeit
 from datetime import datetime as dt
 from enum import Enum
 
+import pytest
+from bson import DBRef
 from mongoengine import (
     BooleanField,
     ComplexDateTimeField,
@@ -18,7 +21,14 @@ from mongoengine import (
     StringField,
 )
 
-from mongoengine_plus.models.helpers import mongo_to_dict, uuid_field
+from mongoengine_plus.models import BaseModel
+from mongoengine_plus.models.helpers import (
+    list_field_to_dict,
+    mongo_to_dict,
+    register_field_converter,
+    register_item_converter,
+    uuid_field,
+)
 from mongoengine_plus.types.enum_field import EnumField
 
 
@@ -108,3 +118,113 @@ def test_mongo_to_dict():
 def test_mongo_to_dict_with_none():
     result = mongo_to_dict(None)
     assert result == {}
+
+
+class Money:
+    def __init__(self, cents: int) -> None:
+        self.cents = cents
+
+
+class MoneyField(IntField):
+    def to_python(self, value):
+        return Money(value)
+
+
+class UTCDateTimeField(DateTimeField):
+    pass
+
+
+register_field_converter(
+    MoneyField,
+    lambda field_name, field: (
+        f'{field_name}_cents',
+        lambda data: None if data is None else data.cents,
+    ),
+)
+register_item_converter(Money, lambda item: item.cents)
+
+
+class Invoice(BaseModel, Document):
+    total = MoneyField()
+    created_at = UTCDateTimeField()
+    count = IntField()
+    payments = ListField(MoneyField())
+
+
+def test_registered_and_subclass_converters():
+    created_at = dt(2024, 1, 2, 3, 4, 5)
+    invoice = Invoice(
+        total=1050, created_at=created_at, count=3, payments=[500, 550]
+    )
+    assert invoice.to_dict() == {
+        'id': 'None',
+        'total_cents': 1050,
+        'created_at': created_at.isoformat(),
+        'count': 3,
+        'payments': [500, 550],
+    }
+
+
+def _chained_list_field_to_dict(list_field: list) -> list:
+    # the isinstance chain the converters replaced
+    return_data: list = []
+    for item in list_field:
+        if isinstance(item, EmbeddedDocument):
+            return_data.append(mongo_to_dict(item))
+        elif isinstance(item, Enum):
+            return_data.append(item.value)
+        elif isinstance(item, DBRef):
+            return_data.append(f'/{item._DBRef__collection}/{item.id}')
+        else:
+            field_type = type(item)
+            if field_type is DateTimeField:
+                return_data.append(item.isoformat())
+            elif field_type is ComplexDateTimeField:
+                return_data.append(item.isoformat())
+            elif field_type is IntField:
+                return_data.append(int(item))
+            elif field_type is BooleanField:
+                return_data.append(bool(item))
+            elif field_type is DecimalField:
+                return_data.append(item)
+            else:
+                return_data.append(str(item))
+    return return_data
+
+
+def test_list_converter_matches_isinstance_chain():
+    items = [1, 1.5, True, EnumType.member, dt(2024, 1, 2), 'text', None]
+    assert list_field_to_dict(items) == _chained_list_field_to_dict(items)
+
+
+@pytest.mark.benchmark
+def test_list_converter_is_faster_than_isinstance_chain():
+    items = list(range(5_000)) + [EnumType.member] * 5_000
+
+    def best(func) -> float:
+        return min(timeit.repeat(lambda: func(items), number=5, repeat=5))
+
+    assert best(list_field_to_dict) < best(_chained_list_field_to_dict)
+
+
+class PercentField(IntField):
+    pass
+
+
+class Discount(BaseModel, Document):
+    rate = PercentField()
+
+
+def test_converters_registered_after_serializing():
+    discount = Discount(rate=15)
+    assert discount.to_dict()['rate'] == 15
+    assert discount.cached_dict()['rate'] == 15
+    register_field_converter(
+        PercentField,
+        lambda field_name, field: (
+            f'{field_name}_percent',
+            lambda value: None if value is None else f'{value}%',
+        ),
+    )
+    assert discount.to_dict() == {'id': 'None', 'rate_percent': '15%'}
+    assert discount.cached_dict() == {'id': 'None', 'rate_percent': '15%'}
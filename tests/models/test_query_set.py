@@ -0,0 +1,221 @@
+from enum import Enum
+
+import pytest
+from mongoengine import Document, IntField, ListField, Q, StringField
+from mongoengine.context_managers import switch_collection
+from pymongo.errors import BulkWriteError
+
+from mongoengine_plus.models import BaseModel, BaseQuerySet, query_set
+from mongoengine_plus.models.bulk import (
+    DeleteMany,
+    DeleteOne,
+    Insert,
+    UpdateMany,
+    UpdateOne,
+)
+from mongoengine_plus.models.helpers import mongo_to_dict
+from mongoengine_plus.types import EnumField
+
+from .test_helpers import (
+    Embedded,
+    HeritageEmbedded,
+    Reference,
+    TestModel as HelpersModel,
+)
+
+
+class Order(BaseModel, Document):
+    number = IntField()
+    status = StringField(default='created')
+    items = ListField(StringField())
+    secret = StringField()
+
+    _hidden = ['secret']
+    meta = dict(queryset_class=BaseQuerySet, allow_inheritance=True)
+
+
+class GiftOrder(Order):
+    message = StringField()
+
+
+def test_to_dicts():
+    orders = [Order(number=i, items=['a'], secret='s') for i in range(5)]
+    orders.append(GiftOrder(number=5, message='hi'))
+    for order in orders:
+        order.save()
+    Order._get_collection().insert_one(dict(_cls='Order', number=6))
+
+    queryset = Order.objects.order_by('number')
+    result = queryset.to_dicts()
+    assert not isinstance(result, list)
+    dicts = list(result)
+    assert dicts == [order.to_dict() for order in queryset]
+    assert dicts[0]['secret'] == '********'
+    assert dicts[5]['message'] == 'hi'
+    assert dicts[6]['status'] == 'created'
+    assert list(Order.objects.none().to_dicts()) == []
+    Order.drop_collection()
+
+
+def test_to_dicts_matches_mongo_to_dict():
+    reference = Reference()
+    reference.save()
+    # the collection of HelpersModel has documents of other tests' models
+    with switch_collection(HelpersModel, 'to_dicts_model') as Model:
+        Model.drop_collection()
+        Model(
+            embedded_list_field=[Embedded(name='')],
+            lazzy_list_field=[reference],
+            embedded_field=Embedded(name='Peter'),
+            heritage_field=HeritageEmbedded(name='some', lastname='other'),
+        ).save()
+        queryset = BaseQuerySet(Model, Model._get_collection())
+        assert list(queryset.to_dicts()) == [
+            mongo_to_dict(model) for model in Model.objects
+        ]
+        Model.drop_collection()
+
+
+def test_to_dicts_projection(monkeypatch):
+    Order(number=0, items=['a'], secret='s').save()
+    GiftOrder(number=1, message='hi').save()
+
+    requested = []
+    next_raw_batch = BaseQuerySet._next_raw_batch
+
+    def record_projection(queryset):
+        requested.append(queryset._loaded_fields.as_dict())
+        return next_raw_batch(queryset)
+
+    monkeypatch.setattr(BaseQuerySet, '_next_raw_batch', record_projection)
+    queryset = Order.objects.order_by('number')
+    dicts = list(queryset.to_dicts(only=['number', 'message']))
+    assert [{key: d[key] for key in d if key != 'id'} for d in dicts] == [
+        dict(number=0),
+        dict(number=1, message='hi'),
+    ]
+    assert requested[0] == dict(_cls=1, number=1, message=1)
+    # names that aren't fields are ignored, as `to_dict` ignores them
+    dicts = list(queryset.to_dicts(only=['number', 'unknown']))
+    assert [d['number'] for d in dicts] == [0, 1]
+    assert requested[-1] == dict(_cls=1, number=1)
+    dicts = list(queryset.to_dicts(exclude=['items', 'unknown.field']))
+    assert dicts == [order.to_dict(exclude=['items']) for order in queryset]
+    dicts = list(queryset.to_dicts(exclude=['items', 'status', 'secret']))
+    assert dicts == [
+        order.to_dict(exclude=['items', 'status', 'secret'])
+        for order in queryset
+    ]
+
+    # the projections of the queryset are serialized too
+    dicts = list(queryset.only('number').to_dicts())
+    assert dicts == [order.to_dict(only=['number']) for order in queryset]
+    assert requested[-1] == dict(_cls=1, number=1)
+    dicts = list(queryset.exclude('items', 'secret').to_dicts())
+    assert dicts == [
+        order.to_dict(exclude=['items', 'secret']) for order in queryset
+    ]
+    dicts = list(queryset.only('number', 'status').to_dicts(exclude=['id']))
+    assert dicts == [
+        order.to_dict(only=['number', 'status'], exclude=['id'])
+        for order in queryset
+    ]
+    dicts = list(queryset.only('number').to_dicts(only=['status']))
+    assert dicts == [
+        order.to_dict(only=['number', 'status']) for order in queryset
+    ]
+    assert [d for d in queryset.to_dicts(only=[])] == [
+        dict(id=str(order.id)) for order in queryset
+    ]
+    Order.drop_collection()
+
+
+def test_bulk_write(monkeypatch):
+    monkeypatch.setattr(query_set, 'BULK_WRITE_CHUNK_SIZE', 2)
+    orders = [Order(number=i) for i in range(4)]
+    result = Order.objects.bulk_write(
+        [Insert(order) for order in orders]
+        + [
+            UpdateOne(Q(number=0), set__status='paid'),
+            UpdateMany(Q(number__gte=2), push__items='gift'),
+            UpdateOne(Q(number=10), set__status='paid', upsert=True),
+            DeleteOne(Q(number=1)),
+        ]
+    )
+    assert all(order.pk for order in orders)
+    assert result.inserted_count == 4
+    assert result.matched_count == 3
+    assert result.modified_count == 3
+    assert result.deleted_count == 1
+    assert list(result.upserted_ids) == [6]
+
+    assert Order.objects.get(number=0).status == 'paid'
+    assert Order.objects(items='gift').count() == 2
+    assert not Order.objects(number=1)
+    upserted = Order.objects.get(number=10)
+    assert upserted.id == result.upserted_ids[6]
+    assert upserted._cls == 'Order'
+
+    # inserted documents track their changes, as saved ones do
+    orders[3].status = 'paid'
+    assert not orders[3]._created
+    assert orders[3]._get_changed_fields() == ['status']
+    orders[3].save()
+    assert Order.objects(number=3).count() == 1
+
+    result = Order.objects(status='paid').bulk_write([DeleteMany()])
+    assert result.deleted_count == 3
+    Order.drop_collection()
+
+
+def test_bulk_write_matches_both_enum_forms():
+    class Size(Enum):
+        small = 'small'
+        large = 'large'
+
+    codes = {Size.small: 1, Size.large: 2}
+
+    class Box(BaseModel, Document):
+        size = EnumField(Size, codes=codes)
+        history = ListField(EnumField(Size, codes=codes))
+        meta = dict(queryset_class=BaseQuerySet)
+
+    Box.drop_collection()
+    # written before the codes
+    Box._get_collection().insert_one(
+        dict(size='small', history=['small', 'large'])
+    )
+    result = Box.objects.bulk_write(
+        [
+            UpdateOne(
+                Q(size=Size.small), pull__history=Size.small, set__size=2
+            ),
+            DeleteMany(Q(size__ne=Size.large)),
+        ]
+    )
+    assert result.modified_count == 1
+    assert result.deleted_count == 0
+    box = Box._get_collection().find_one()
+    assert box['size'] == 2
+    assert box['history'] == ['large']
+    Box.drop_collection()
+
+
+@pytest.mark.parametrize('ordered, inserted', [(True, 1), (False, 3)])
+def test_bulk_write_errors(monkeypatch, ordered, inserted):
+    monkeypatch.setattr(query_set, 'BULK_WRITE_CHUNK_SIZE', 2)
+    saved = Order(number=0)
+    saved.save()
+    orders = [Order(number=i) for i in range(1, 4)]
+    with pytest.raises(BulkWriteError) as exc_info:
+        Order.objects.bulk_write(
+            [Insert(orders[0]), Insert(saved)]
+            + [Insert(order) for order in orders[1:]],
+            ordered=ordered,
+        )
+    details = exc_info.value.details
+    assert details['nInserted'] == inserted
+    assert [error['index'] for error in details['writeErrors']] == [1]
+    assert Order.objects.count() == inserted + 1
+    assert bool(orders[2].pk) is not ordered
+    Order.drop_collection()
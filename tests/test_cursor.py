@@ -0,0 +1,16 @@
+from mongoengine import get_db
+from pymongo.command_cursor import CommandCursor
+
+from mongoengine_plus.cursor import buffered, next_batch
+
+
+def test_next_batch_of_command_cursor():
+    # a cursor with its last batch, as pymongo creates it
+    collection = get_db()['cursor']
+    cursor = CommandCursor(
+        collection, dict(id=0, firstBatch=[{'n': 1}, {'n': 2}]), None
+    )
+    assert buffered(cursor) == 2
+    assert next_batch(cursor) == [{'n': 1}, {'n': 2}]
+    assert buffered(cursor) == 0
+    assert next_batch(cursor) == []
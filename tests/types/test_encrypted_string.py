@@ -1,22 +1,52 @@
+import copy
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from typing import Generator
 from unittest.mock import patch
 
 import pytest
 from bson import Binary
-from mongoengine import Document, StringField
+from mongoengine import (
+    Document,
+    EmbeddedDocument,
+    EmbeddedDocumentField,
+    StringField,
+)
 from pymongo import MongoClient
 from pymongo.encryption import Algorithm, ClientEncryption, _EncryptionIO
 
-from mongoengine_plus.models import uuid_field
+from mongoengine_plus.aio import AsyncDocument
+from mongoengine_plus.models import BaseModel, uuid_field
 from mongoengine_plus.types import EncryptedStringField
-from mongoengine_plus.types.encrypted_string import cache_kms_data_key
+from mongoengine_plus.types.encrypted_string import (
+    EncryptedQuerySet,
+    base,
+    cache_kms_data_key,
+    query_set,
+)
 from mongoengine_plus.types.encrypted_string.base import (
+    close_client_encryptions,
+    configure_data_key_cache,
     create_data_key,
+    data_key_cache,
+    get_client_encryption,
     get_data_key,
+    get_data_key_binary,
+    invalidate_data_key,
+    use_kms_data_key_cache,
+)
+from mongoengine_plus.types.encrypted_string.cache import LRUCache
+from mongoengine_plus.types.encrypted_string.exc import (
+    KeyNameNotResolved,
+    NoDataKeyFound,
+)
+from mongoengine_plus.types.encrypted_string.fields import (
+    CODEC_OPTION,
+    decrypted_string,
 )
-from mongoengine_plus.types.encrypted_string.exc import NoDataKeyFound
-from mongoengine_plus.types.encrypted_string.fields import CODEC_OPTION
 
 
 class User(Document):
@@ -29,6 +59,98 @@ class User(Document):
     )
 
 
+class Customer(Document):
+    meta = dict(queryset_class=EncryptedQuerySet)
+    id = StringField(primary_key=True, default=uuid_field('CU'))
+    name = StringField()
+    ssn = EncryptedStringField(
+        algorithm=Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic,
+    )
+    email = EncryptedStringField(
+        algorithm=Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random,
+    )
+
+
+class Account(BaseModel, Document):
+    _hidden = ['pin']
+    id = StringField(primary_key=True, default=uuid_field('AC'))
+    name = StringField()
+    pin = EncryptedStringField(
+        algorithm=Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random,
+        lazy=True,
+    )
+    clabe = EncryptedStringField(
+        algorithm=Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random,
+        lazy=True,
+    )
+
+
+class Patient(AsyncDocument):
+    id = StringField(primary_key=True, default=uuid_field('PA'))
+    name = StringField()
+    curp = EncryptedStringField(
+        algorithm=Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random,
+    )
+
+
+class TenantProfile(EmbeddedDocument):
+    curp = EncryptedStringField(
+        algorithm=Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic,
+        key_name=lambda user: user.tenant,
+    )
+
+
+class TenantUser(Document):
+    id = StringField(primary_key=True, default=uuid_field('TU'))
+    tenant = StringField()
+    profile = EmbeddedDocumentField(TenantProfile)
+    ssn = EncryptedStringField(
+        algorithm=Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic,
+        key_name=lambda user: user.tenant,
+    )
+    phone = EncryptedStringField(
+        algorithm=Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random,
+        key_name='tenant-b',
+    )
+
+
+@pytest.fixture
+def tenant_data_keys(
+    setup_encrypted_string_data_key: None,
+    kms_key_arn: str,
+    kms_connection_url: str,
+    db_connection: MongoClient,
+) -> Generator[None, None, None]:
+    key_names = ['tenant-a', 'tenant-b']
+    for key_name in key_names:
+        create_data_key(
+            EncryptedStringField.kms_provider,
+            EncryptedStringField.key_namespace,
+            kms_key_arn,
+            key_name,
+            kms_connection_url,
+            'us-east-1',
+        )
+    yield
+    db_name, collection_name = EncryptedStringField.key_namespace.split('.')
+    db_connection[db_name][collection_name].delete_many(
+        {'keyAltNames': {'$in': key_names}}
+    )
+    invalidate_data_key()
+
+
+@pytest.fixture
+def customers() -> Generator[list, None, None]:
+    customers = [
+        Customer(name=f'customer {i}', ssn=f'ssn{i}', email=f'{i}@mail.com')
+        for i in range(10)
+    ]
+    for customer in customers:
+        customer.save()
+    yield customers
+    Customer.objects.delete()
+
+
 @pytest.fixture
 def user() -> Generator[User, None, None]:
     user = User(name='Frida Kahlo', ssn='123456')
@@ -140,7 +262,7 @@ def test_cache_kms_request(kms_connection_url: str) -> None:
     # certificate verification. This is a workaround and should not be done
     # in production environments.
     with patch('boto3.client', partial(boto3.client, verify=False)):
-        cache_kms_data_key(
+        cache = cache_kms_data_key(
             EncryptedStringField.key_namespace,
             EncryptedStringField.key_name,
             'test',
@@ -148,10 +270,415 @@ def test_cache_kms_request(kms_connection_url: str) -> None:
             'us-east-1',
             kms_connection_url,
         )
-        assert _EncryptionIO.kms_request != original_kms_request
+    # pymongo isn't patched globally
+    assert _EncryptionIO.kms_request is original_kms_request
+    assert cache.plaintexts.info().currsize == 1
+
+    # a new ClientEncryption has to ask KMS for the data key again
+    close_client_encryptions()
+    user = User(name='foo', ssn='123456')
+    user.save()
+    user_db = User.objects(ssn=user.ssn).first()
+    assert user_db.id == user.id
+    user.delete()
+    assert cache.plaintexts.info().hits == 1
+    use_kms_data_key_cache(None)
+
+
+@pytest.mark.usefixtures('tenant_data_keys')
+def test_cache_multiple_kms_data_keys(kms_connection_url: str) -> None:
+    import boto3
+
+    with patch('boto3.client', partial(boto3.client, verify=False)):
+        cache = cache_kms_data_key(
+            EncryptedStringField.key_namespace,
+            ['tenant-a', 'tenant-b'],
+            'test',
+            'test',
+            'us-east-1',
+            kms_connection_url,
+            ttl=60,
+        )
+        assert cache.plaintexts.info().currsize == 2
+        cache.refresh()
+        assert cache.plaintexts.info().currsize == 2
+
+    close_client_encryptions()
+    user = TenantUser(tenant='tenant-a', ssn='123', phone='5500000000')
+    user.save()
+    assert TenantUser.objects.get(id=user.id).phone == '5500000000'
+    assert cache.plaintexts.info().hits == 2
+    user.delete()
+
+    cache.clear()
+    assert cache.plaintexts.info().currsize == 0
+    use_kms_data_key_cache(None)
+
+
+@pytest.mark.usefixtures('tenant_data_keys')
+def test_cache_kms_data_key_not_found(kms_connection_url: str) -> None:
+    with pytest.raises(NoDataKeyFound) as exc_info:
+        cache_kms_data_key(
+            EncryptedStringField.key_namespace,
+            ['tenant-a', 'missing'],
+            'test',
+            'test',
+            'us-east-1',
+            kms_connection_url,
+        )
+    assert exc_info.value.args == ('missing',)
+
+
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+def test_client_encryption_is_reused() -> None:
+    client_encryption = get_client_encryption(
+        EncryptedStringField.kms_provider, EncryptedStringField.key_namespace
+    )
+    assert User.ssn.client_encryption is client_encryption
+    assert User.ssn.to_python(User.ssn.to_mongo('123456')) == '123456'
+
+    EncryptedStringField.configure_aws_kms(
+        EncryptedStringField.key_namespace,
+        EncryptedStringField.key_name,
+        'test',
+        'test',
+        'us-east-1',
+    )
+    assert User.ssn.client_encryption is not client_encryption
+    assert client_encryption._encryption is None  # closed
+
+
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+def test_client_encryption_is_created_once() -> None:
+    ciphertext = User.ssn.to_mongo('123456')
+    with patch.object(
+        base, 'ClientEncryption', wraps=ClientEncryption
+    ) as client_encryption:
+        for _ in range(20):
+            assert User.ssn.to_python(ciphertext) == '123456'
+    client_encryption.assert_not_called()
+
+
+@pytest.mark.benchmark
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+def test_client_encryption_reuse_benchmark(db_connection: MongoClient) -> None:
+    ciphertext = User.ssn.to_mongo('123456')
+    iterations = 20
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with ClientEncryption(
+            EncryptedStringField.kms_provider,
+            EncryptedStringField.key_namespace,
+            db_connection,
+            CODEC_OPTION,
+        ) as client_encryption:
+            client_encryption.decrypt(ciphertext)
+    per_value_before = (time.perf_counter() - start) / iterations
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        User.ssn.to_python(ciphertext)
+    per_value_after = (time.perf_counter() - start) / iterations
+
+    print(
+        f'decrypt per value: {per_value_before * 1000:.3f}ms before, '
+        f'{per_value_after * 1000:.3f}ms after'
+    )
+    assert per_value_after < per_value_before
+
+
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+def test_batch_decryption(customers: list) -> None:
+    with (
+        patch.object(
+            query_set, 'decrypt_many', wraps=query_set.decrypt_many
+        ) as decrypt_many,
+        patch.object(ClientEncryption, 'decrypt') as decrypt,
+    ):
+        customers_db = list(Customer.objects.order_by('name'))
+        # all the values of the cursor batch are decrypted at once
+        assert decrypt_many.call_count == 1
+        decrypt.assert_not_called()
+
+    assert [(c.id, c.ssn, c.email) for c in customers_db] == [
+        (c.id, c.ssn, c.email) for c in customers
+    ]
+    assert not customers_db[0]._get_changed_fields()
+
+
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+def test_batch_decryption_with_batch_size(customers: list) -> None:
+    with patch.object(
+        query_set, 'decrypt_many', wraps=query_set.decrypt_many
+    ) as decrypt_many:
+        customers_db = list(Customer.objects.order_by('name').batch_size(4))
+    assert decrypt_many.call_count == 3
+    assert [c.email for c in customers_db] == [c.email for c in customers]
+    assert Customer.objects.get(ssn='ssn3').email == '3@mail.com'
+
+
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+def test_lazy_decryption() -> None:
+    account = Account(name='Frida', pin='1234', clabe='646180157000000004')
+    account.save()
+    raw = Account._get_collection().find_one({'_id': account.id})
+
+    with patch.object(
+        ClientEncryption,
+        'decrypt',
+        wraps=Account.pin.client_encryption.decrypt,
+    ) as decrypt:
+        account_db = Account.objects.get(id=account.id)
+        assert account_db._data['pin'] == raw['pin']
+        decrypt.assert_not_called()
+
+        # hidden fields are never decrypted and keep their position
+        account_dict = account_db.to_dict()
+        assert account_dict == dict(
+            id=account.id,
+            name='Frida',
+            pin='********',
+            clabe='646180157000000004',
+        )
+        assert list(account_dict) == ['id', 'name', 'pin', 'clabe']
+        assert decrypt.call_count == 1
+        assert pickle.loads(pickle.dumps(account_dict)) == account_dict
+
+        assert account_db.pin == '1234'
+        assert account_db.pin == '1234'
+        assert decrypt.call_count == 2
+
+    # untouched values keep their original ciphertext
+    assert not account_db._get_changed_fields()
+    son = account_db.to_mongo()
+    assert son['pin'] == raw['pin']
+    assert son['clabe'] == raw['clabe']
+
+    account_db.pin = '4321'
+    account_db.save()
+    saved = Account._get_collection().find_one({'_id': account.id})
+    assert saved['clabe'] == raw['clabe']
+    assert Account.objects.get(id=account.id).pin == '4321'
+    account.delete()
+
+
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+def test_copied_lazy_values_are_encrypted_again() -> None:
+    account = Account(name='Frida', pin='1234', clabe='646180157000000004')
+    account.save()
+    raw = Account._get_collection().find_one({'_id': account.id})
+    account_db = Account.objects.get(id=account.id)
+
+    other = Account(name='Diego', pin=account_db.pin)
+    account_db.clabe = account_db.pin
+    assert other.to_mongo()['pin'] != raw['pin']
+    assert account_db.to_mongo()['clabe'] != raw['pin']
+    # the same field of the same document keeps its ciphertext
+    account_db.pin = account_db.pin
+    assert account_db.to_mongo()['pin'] == raw['pin']
+
+    other.save()
+    assert Account.objects.get(id=other.id).pin == '1234'
+    account.delete()
+    other.delete()
+
+
+def test_plaintexts_are_copied_as_str() -> None:
+    account = Account(name='Frida')
+    user = TenantUser(tenant='tenant-a', ssn='123')
+    values = [
+        decrypted_string('1234', Binary(b'ciphertext', 6), account, 'pin'),
+        user._data['ssn'],
+    ]
+    for value in values:
+        for copied in (
+            pickle.loads(pickle.dumps(value)),
+            copy.deepcopy(value),
+        ):
+            assert copied == value
+            assert type(copied) is str
+
+
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+def test_deterministic_query_cache(customers: list) -> None:
+    EncryptedStringField.query_cache.clear()
+    with patch.object(
+        ClientEncryption,
+        'encrypt',
+        wraps=Customer.ssn.client_encryption.encrypt,
+    ) as encrypt:
+        for _ in range(3):
+            assert Customer.objects(ssn='ssn1').first().name == 'customer 1'
+        assert encrypt.call_count == 1
+        # random encryption is never cached
+        assert not Customer.objects(email='1@mail.com').first()
+        assert not Customer.objects(email='1@mail.com').first()
+        assert encrypt.call_count == 3
+
+    info = EncryptedStringField.query_cache.info()
+    assert (info.hits, info.misses, info.currsize) == (2, 1, 1)
+
+    EncryptedStringField.configure_query_cache(maxsize=0)
+    assert EncryptedStringField.query_cache.info().currsize == 0
+    EncryptedStringField.configure_query_cache(maxsize=1024)
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+async def test_async_encrypt_and_decrypt() -> None:
+    ciphertext = await Patient.curp.async_encrypt('GODE561231GR8')
+    assert isinstance(ciphertext, Binary)
+    assert await Patient.curp.async_decrypt(ciphertext) == 'GODE561231GR8'
+    assert await Patient.curp.async_decrypt(None) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+async def test_async_save_encrypts_on_crypto_executor() -> None:
+    threads = []
+    encrypt = Patient.curp.client_encryption.encrypt
+
+    def tracked_encrypt(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return encrypt(*args, **kwargs)
+
+    patient = Patient(name='Frida', curp='GODE561231GR8')
+    with patch.object(
+        ClientEncryption, 'encrypt', side_effect=tracked_encrypt
+    ):
+        await patient.async_save()
+    assert len(threads) == 1
+    assert threads[0].startswith('mongoengine-plus-crypto')
+    assert patient.curp == 'GODE561231GR8'
+    patient_db = await Patient.objects.async_get(id=patient.id)
+    assert patient_db.curp == 'GODE561231GR8'
+    await patient.async_delete()
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+async def test_async_to_list_decrypts_on_crypto_executor() -> None:
+    for i in range(5):
+        await Patient(name=f'patient {i}', curp=f'CURP{i}').async_save()
+
+    with patch.object(
+        query_set, 'decrypt_documents', wraps=query_set.decrypt_documents
+    ) as decrypt_documents:
+        patients = await Patient.objects.order_by('name').async_to_list()
+    decrypt_documents.assert_called_once()
+    assert [p.curp for p in patients] == [f'CURP{i}' for i in range(5)]
+    await Patient.objects.async_delete()
+
+
+@pytest.mark.usefixtures('setup_encrypted_string_data_key')
+def test_data_key_cache() -> None:
+    key_namespace = EncryptedStringField.key_namespace
+    invalidate_data_key()
+    with patch.object(base, 'get_data_key', wraps=get_data_key) as fetch:
+        data_key = get_data_key_binary(key_namespace, 'thekey')
+        assert get_data_key_binary(key_namespace, 'thekey') == data_key
+        assert fetch.call_count == 1
+        with pytest.raises(NoDataKeyFound):
+            get_data_key_binary(key_namespace, 'unknown')
+        assert fetch.call_count == 2
+
+        # the key is fetched again after being invalidated
+        invalidate_data_key(key_namespace, 'thekey')
+        assert get_data_key_binary(key_namespace, 'thekey') == data_key
+        assert fetch.call_count == 3
+
+        configure_data_key_cache(ttl=0.01)
+        time.sleep(0.02)
+        assert get_data_key_binary(key_namespace, 'thekey') == data_key
+        assert fetch.call_count == 4
+        # resizing keeps the ttl
+        configure_data_key_cache(maxsize=16)
+        assert data_key_cache.ttl == 0.01
+        configure_data_key_cache(ttl=0)
+
+    info = data_key_cache.info()
+    assert info.hits >= 1
+    assert info.currsize == 1
+
+
+def test_lru_cache_get_or_set() -> None:
+    cache = LRUCache(maxsize=2)
+
+    def missing() -> str:
+        raise NoDataKeyFound
+
+    with pytest.raises(NoDataKeyFound):
+        cache.get_or_set('key', missing)
+    assert not cache._key_locks
+
+    calls = []
+
+    def factory() -> str:
+        calls.append(threading.current_thread().name)
+        time.sleep(0.05)
+        return 'value'
+
+    # concurrent misses wait for the first one
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        values = list(
+            executor.map(lambda _: cache.get_or_set('key', factory), range(4))
+        )
+    assert values == ['value'] * 4
+    assert len(calls) == 1
+    assert not cache._key_locks
+
 
-        user = User(name='foo', ssn='123456')
-        user.save()
-        user_db = User.objects(ssn=user.ssn).first()
-        assert user_db.id == user.id
-        user.delete()
+@pytest.mark.usefixtures('tenant_data_keys')
+def test_key_name_per_field_and_document() -> None:
+    user_a = TenantUser(tenant='tenant-a', ssn='123', phone='5500000000')
+    user_b = TenantUser(tenant='tenant-b', ssn='123', phone='5500000000')
+    user_a.save()
+    user_b.save()
+
+    raw_a = TenantUser._get_collection().find_one({'_id': user_a.id})
+    raw_b = TenantUser._get_collection().find_one({'_id': user_b.id})
+    # same plaintext and deterministic algorithm but different data keys
+    assert raw_a['ssn'] != raw_b['ssn']
+    assert raw_a['ssn'] == TenantUser.ssn.encrypt('123', key_name='tenant-a')
+
+    user_db = TenantUser.objects.get(
+        ssn=TenantUser.ssn.encrypt('123', key_name='tenant-b')
+    )
+    assert user_db.id == user_b.id
+    assert user_db.ssn == '123'
+    assert user_db.phone == '5500000000'
+
+    # there's no document to pick the key from
+    with pytest.raises(KeyNameNotResolved):
+        TenantUser.objects(ssn='123').first()
+
+    user_db.ssn = '456'
+    user_db.save()
+    assert TenantUser.objects(
+        ssn=TenantUser.ssn.encrypt('456', key_name='tenant-b')
+    ).first()
+    TenantUser.objects.delete()
+
+
+@pytest.mark.usefixtures('tenant_data_keys')
+def test_copied_values_use_the_key_of_their_document() -> None:
+    user_a = TenantUser(tenant='tenant-a', ssn='123')
+    user_b = TenantUser(tenant='tenant-b', profile=TenantProfile(curp='GODE'))
+    user_b.ssn = user_a.ssn
+    # the document it was copied from doesn't have to exist anymore
+    user_c = TenantUser(
+        tenant='tenant-b', ssn=TenantUser(tenant='tenant-a', ssn='456').ssn
+    )
+    user_b.save()
+    user_c.save()
+
+    raw_b = TenantUser._get_collection().find_one({'_id': user_b.id})
+    raw_c = TenantUser._get_collection().find_one({'_id': user_c.id})
+    assert raw_b['ssn'] == TenantUser.ssn.encrypt('123', key_name='tenant-b')
+    assert raw_c['ssn'] == TenantUser.ssn.encrypt('456', key_name='tenant-b')
+    # embedded documents use the key of the document they're in
+    assert raw_b['profile']['curp'] == TenantProfile.curp.encrypt(
+        'GODE', key_name='tenant-b'
+    )
+    TenantUser.objects.delete()
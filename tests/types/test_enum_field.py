@@ -0,0 +1,175 @@
+from enum import Enum
+
+import pytest
+from mongoengine import Document, ListField, ValidationError
+
+from mongoengine_plus.types import EnumField, EnumQuerySet, migrate_enum_field
+
+
+class Status(Enum):
+    active = 'active'
+    suspended_by_compliance = 'suspended_by_compliance'
+
+
+class EnumAccount(Document):
+    status = EnumField(Status, default=Status.active)
+    history = ListField(EnumField(Status))
+
+
+CODES = {Status.active: 1, Status.suspended_by_compliance: 2}
+
+
+class CompactEnumAccount(Document):
+    status = EnumField(Status, codes=CODES, default=Status.active)
+    history = ListField(EnumField(Status, codes=CODES))
+    meta = dict(collection='enum_account', queryset_class=EnumQuerySet)
+
+
+def test_enum_field():
+    field = EnumAccount.status
+    assert field.to_python('active') is Status.active
+    assert field.to_python(Status.active) is Status.active
+    assert field.to_mongo(Status.active) == 'active'
+    assert field.to_mongo('active') == 'active'
+    with pytest.raises(ValueError):
+        field.to_python('missing')
+
+    account = EnumAccount(status='active', history=[Status.active])
+    account.validate()
+    account.history = ['missing']
+    with pytest.raises(ValidationError):
+        account.validate()
+    account.history = []
+    account.status = []
+    with pytest.raises(ValidationError):
+        account.validate()
+
+
+def test_enum_field_codes():
+    field = CompactEnumAccount.status
+    assert field.to_mongo(Status.suspended_by_compliance) == 2
+    assert field.to_python(2) is Status.suspended_by_compliance
+    # values stored before the codes are read as well
+    assert field.to_python('suspended_by_compliance') is (
+        Status.suspended_by_compliance
+    )
+    assert EnumField(Status, codes=CODES, store_codes=False).to_mongo(
+        Status.suspended_by_compliance
+    ) == ('suspended_by_compliance')
+
+    with pytest.raises(ValueError):
+        EnumField(
+            Status, codes={Status.active: 1, Status.suspended_by_compliance: 1}
+        )
+    with pytest.raises(ValueError):
+        EnumField(Status, codes={Status.active: 'suspended_by_compliance'})
+
+
+def test_migrate_enum_field():
+    EnumAccount.drop_collection()
+    account = EnumAccount(
+        status=Status.suspended_by_compliance,
+        history=[Status.active, Status.suspended_by_compliance],
+    ).save()
+    EnumAccount(status=Status.active).save()
+
+    compact = CompactEnumAccount.objects.get(id=account.id)
+    assert compact.status is Status.suspended_by_compliance
+    assert compact.history == account.history
+
+    assert migrate_enum_field(CompactEnumAccount, 'status') == 2
+    assert migrate_enum_field(CompactEnumAccount, 'history') == 1
+    assert migrate_enum_field(CompactEnumAccount, 'status') == 0
+    raw = CompactEnumAccount._get_collection().find_one({'_id': account.id})
+    assert raw['status'] == 2
+    assert raw['history'] == [1, 2]
+    assert CompactEnumAccount.objects(status=Status.active).count() == 1
+    compact.reload()
+    assert compact.status is Status.suspended_by_compliance
+    assert compact.history == account.history
+
+
+def test_queries_match_both_forms_until_migrated():
+    EnumAccount.drop_collection()
+    old = EnumAccount(
+        status=Status.suspended_by_compliance, history=[Status.active]
+    ).save()
+    new = CompactEnumAccount(
+        status=Status.suspended_by_compliance,
+        history=[Status.suspended_by_compliance],
+    ).save()
+
+    def ids(**query):
+        return {account.id for account in CompactEnumAccount.objects(**query)}
+
+    suspended = Status.suspended_by_compliance
+    assert ids(status=suspended) == {old.id, new.id}
+    assert ids(status='suspended_by_compliance') == {old.id, new.id}
+    assert ids(status__in=[suspended]) == {old.id, new.id}
+    assert ids(status__nin=[suspended]) == set()
+    assert ids(status__ne=suspended) == set()
+    assert ids(status__not__in=[suspended]) == set()
+    assert ids(history__in=[Status.active]) == {old.id}
+    assert ids(history__nin=[Status.active]) == {new.id}
+    assert ids(history__ne=Status.active) == {new.id}
+    assert CompactEnumAccount.objects(status=suspended)._query == {
+        'status': {'$in': [2, 'suspended_by_compliance']}
+    }
+    assert CompactEnumAccount.objects(status__ne=suspended)._query == {
+        'status': {'$nin': [2, 'suspended_by_compliance']}
+    }
+    # other operators are sent in the stored form
+    assert CompactEnumAccount.objects(status__gt=Status.active)._query == {
+        'status': {'$gt': 1}
+    }
+    # whole lists are matched in the stored form
+    assert ids(history=[suspended]) == {new.id}
+
+    migrate_enum_field(CompactEnumAccount, 'status')
+    migrate_enum_field(CompactEnumAccount, 'history')
+    assert ids(status=suspended) == {old.id, new.id}
+    assert ids(history__in=[Status.active]) == {old.id}
+    EnumAccount.drop_collection()
+
+
+def test_pulls_remove_both_forms_until_migrated():
+    EnumAccount.drop_collection()
+    both = [Status.active, Status.suspended_by_compliance]
+    old = EnumAccount(history=both).save()
+    new = CompactEnumAccount(history=both).save()
+
+    def histories():
+        return [account.history for account in CompactEnumAccount.objects]
+
+    CompactEnumAccount.objects.update(pull__history=Status.active)
+    assert histories() == [[Status.suspended_by_compliance]] * 2
+    CompactEnumAccount.objects.update(
+        pull__history__in=[Status.suspended_by_compliance]
+    )
+    assert histories() == [[], []]
+
+    CompactEnumAccount.objects.update(push_all__history=both)
+    EnumAccount.objects(id=old.id).update(set__history=both)
+    CompactEnumAccount.objects.update(pull_all__history=both)
+    assert histories() == [[], []]
+
+    CompactEnumAccount.objects(id=new.id).update(push_all__history=both)
+    EnumAccount.objects(id=old.id).update(set__history=both)
+    account = CompactEnumAccount.objects(id=old.id).modify(
+        pull__history=Status.active, new=True
+    )
+    assert account.history == [Status.suspended_by_compliance]
+    new.update(pull__history=Status.suspended_by_compliance)
+    new.reload()
+    assert new.history == [Status.active]
+    EnumAccount.drop_collection()
+
+
+def test_plain_querysets_send_the_stored_form():
+    class PlainEnumAccount(Document):
+        status = EnumField(Status, codes=CODES)
+        meta = dict(collection='enum_account')
+
+    assert PlainEnumAccount.objects(status=Status.active)._query == {
+        'status': 1
+    }